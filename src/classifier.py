@@ -3,7 +3,10 @@ from pathlib import Path
 import json
 import time
 import logging
+from typing import List
 import modal
+from embedding_store import EmbeddingStore, score_embeddings
+from classifier_core import CATEGORIES, CATEGORY_FOLDER_NAMES, CLIP_MODEL_NAME, ClassifierCore, build_prompts, get_text_features, image_embedding_dir, log_job_summary, reduce_post_scores
 
 
 try:
@@ -32,6 +35,30 @@ PYTHON_VERSION = os.environ.get("MODAL_PYTHON_VERSION", "3.10")
 
 GDRIVE_PARENT_FOLDER_ID = os.environ.get("GDRIVE_PARENT_FOLDER_ID")
 
+# Dynamic batching: inputs queued in a container are flushed to process_item once
+# BATCH_SIZE of them are waiting or BATCH_WAIT_MS has elapsed, whichever comes first.
+BATCH_SIZE = int(os.environ.get("CLASSIFIER_BATCH_SIZE", "32"))
+
+BATCH_WAIT_MS = int(os.environ.get("CLASSIFIER_BATCH_WAIT_MS", "200"))
+
+# Persistent volume holding caches that should survive short-lived containers
+CACHE_VOLUME_NAME = os.environ.get("MODAL_CACHE_VOLUME_NAME", "clip-classifier-cache")
+
+CONTAINER_CACHE_DIR = Path(os.environ.get("CONTAINER_CACHE_DIR", "/cache/"))
+
+# Drive uploads: files of an item are uploaded on UPLOAD_WORKERS threads; files up to
+# RESUMABLE_UPLOAD_THRESHOLD bytes go as one multipart request instead of a resumable session.
+UPLOAD_WORKERS = int(os.environ.get("DRIVE_UPLOAD_WORKERS", "8"))
+
+RESUMABLE_UPLOAD_THRESHOLD = int(os.environ.get("DRIVE_RESUMABLE_UPLOAD_THRESHOLD", str(5 * 1024 * 1024)))
+
+# Folder lookups/creations of a batch of items are sent as Drive batch requests of at most
+# DRIVE_BATCH_SIZE calls (Drive's limit is 100)
+DRIVE_BATCH_SIZE = min(100, int(os.environ.get("DRIVE_BATCH_SIZE", "100")))
+
+# Overrides the Drive API root URL, e.g. to point the client at a local fake Drive server
+DRIVE_API_ENDPOINT = os.environ.get("DRIVE_API_ENDPOINT")
+
 # --- Logging Setup ---
 log_level_str = os.environ.get("LOG_LEVEL", "INFO").upper()
 log_level = getattr(logging, log_level_str, logging.INFO)
@@ -63,19 +90,19 @@ image = (
         "google-auth-oauthlib",
         "google-auth-httplib2",
         "python-dotenv", # Needed for .env loading if used inside container (less common)
+        "numpy",
     )
     .add_local_dir(str(LOCAL_DOWNLOADS_DIR), str(CONTAINER_DOWNLOADS_DIR))
+    .add_local_python_source("classifier_core", "embedding_store", "image_pipeline")
 )
 
 # Create a Modal App instance
 app = modal.App(f"clip-classifier-{ROOT_FOLDER_NAME.lower().replace(' ', '-')}", image=image)
 
+cache_volume = modal.Volume.from_name(CACHE_VOLUME_NAME, create_if_missing=True)
 
-
-def create_drive_folder(service, folder_name, parent_folder_id=None):
-    """Creates a new folder in Google Drive or returns its ID if it already exists."""
-    from googleapiclient.errors import HttpError
-
+def _folder_query(folder_name, parent_folder_id=None):
+    """Drive search query matching a non-trashed folder by name directly under a parent (or 'root')."""
     # Escape single quotes in folder names for the query
     safe_folder_name = folder_name.replace("'", "\\'")
 
@@ -89,6 +116,24 @@ def create_drive_folder(service, folder_name, parent_folder_id=None):
     else:
         # If checking in root (no parent specified), ensure it's directly in 'root'
         query += " and 'root' in parents"
+    return query
+
+
+def _folder_metadata(folder_name, parent_folder_id=None):
+    file_metadata = {
+        'name': folder_name,
+        'mimeType': 'application/vnd.google-apps.folder'
+    }
+    if parent_folder_id:
+        file_metadata['parents'] = [parent_folder_id]
+    return file_metadata
+
+
+def create_drive_folder(service, folder_name, parent_folder_id=None):
+    """Creates a new folder in Google Drive or returns its ID if it already exists."""
+    from googleapiclient.errors import HttpError
+
+    query = _folder_query(folder_name, parent_folder_id)
 
     try:
         response = service.files().list(q=query, fields="files(id, name)", pageSize=1).execute()
@@ -102,12 +147,7 @@ def create_drive_folder(service, folder_name, parent_folder_id=None):
         return None # Indicate failure
 
     # Folder does not exist, create it
-    file_metadata = {
-        'name': folder_name,
-        'mimeType': 'application/vnd.google-apps.folder'
-    }
-    if parent_folder_id:
-        file_metadata['parents'] = [parent_folder_id]
+    file_metadata = _folder_metadata(folder_name, parent_folder_id)
 
     try:
         file = service.files().create(body=file_metadata, fields='id').execute()
@@ -119,7 +159,218 @@ def create_drive_folder(service, folder_name, parent_folder_id=None):
         return None # Indicate failure
 
 
-def upload_to_drive(service, folder_id, file_path):
+def new_drive_batch(service, callback=None):
+    """
+    Creates a batch request for the Drive service.
+
+    The discovery document's batch path ignores client_options, so with DRIVE_API_ENDPOINT set
+    the batch URI is built from the overridden endpoint instead.
+    """
+    if DRIVE_API_ENDPOINT:
+        from googleapiclient.http import BatchHttpRequest
+
+        return BatchHttpRequest(callback=callback, batch_uri=f"{DRIVE_API_ENDPOINT.rstrip('/')}/batch/drive/v3")
+    return service.new_batch_http_request(callback=callback)
+
+
+def execute_drive_batch(service, requests, http=None):
+    """
+    Executes Drive requests as batch requests of at most DRIVE_BATCH_SIZE calls each.
+
+    Args:
+        requests: (request_id, HttpRequest) pairs with unique string request IDs.
+        http: Authorized Http object to send the batches on instead of the requests' own.
+
+    Returns:
+        A dictionary mapping every request ID to (response, exception), where exception is None
+        on success. If a whole batch fails, each of its requests is mapped to that exception.
+    """
+    results = {}
+
+    def callback(request_id, response, exception):
+        results[request_id] = (response, exception)
+
+    for start in range(0, len(requests), DRIVE_BATCH_SIZE):
+        chunk = requests[start:start + DRIVE_BATCH_SIZE]
+        batch = new_drive_batch(service, callback)
+        for request_id, request in chunk:
+            batch.add(request, request_id=request_id)
+        try:
+            batch.execute(http=http)
+        except Exception as e:
+            logger.error(f"An error occurred executing a batch of {len(chunk)} Drive requests: {e}")
+            for request_id, _ in chunk:
+                results.setdefault(request_id, (None, e))
+    return results
+
+
+def batch_create_drive_folders(service, folders, http=None):
+    """
+    Finds or creates many folders with batch requests, like create_drive_folder for each.
+
+    All lookups are sent in one round of batches, then all missing folders are created in a
+    second round, so N folders cost about 2 * N / DRIVE_BATCH_SIZE HTTP round trips instead of
+    up to 2 * N.
+
+    Args:
+        folders: (folder_name, parent_folder_id) pairs. Repeated pairs are looked up and created
+                 once; repeats after the first report (False, folder_id).
+
+    Returns:
+        One (created, folder_id) tuple, or None on failure, per pair in order.
+    """
+    unique = list(dict.fromkeys(folders))
+    resolved = {}
+
+    lookups = [
+        (str(i), service.files().list(q=_folder_query(name, parent), fields="files(id, name)", pageSize=1))
+        for i, (name, parent) in enumerate(unique)
+    ]
+    for request_id, (response, error) in execute_drive_batch(service, lookups, http).items():
+        folder_name, parent_folder_id = unique[int(request_id)]
+        if error is not None:
+            logger.error(f"An error occurred checking for folder '{folder_name}': {error}")
+            resolved[unique[int(request_id)]] = None
+        elif response.get('files'):
+            folder_id = response['files'][0]['id']
+            logger.debug(f"Folder '{folder_name}' already exists with ID: {folder_id} under parent {parent_folder_id or 'root'}")
+            resolved[unique[int(request_id)]] = (False, folder_id)
+
+    missing = [pair for pair in unique if pair not in resolved]
+    creates = [
+        (str(i), service.files().create(body=_folder_metadata(name, parent), fields='id'))
+        for i, (name, parent) in enumerate(missing)
+    ]
+    for request_id, (response, error) in execute_drive_batch(service, creates, http).items():
+        folder_name, parent_folder_id = missing[int(request_id)]
+        if error is not None:
+            logger.error(f"An error occurred creating folder '{folder_name}': {error}")
+            resolved[missing[int(request_id)]] = None
+        else:
+            folder_id = response.get('id')
+            logger.info(f"Created folder '{folder_name}' with ID: {folder_id} under parent {parent_folder_id or 'root'}")
+            resolved[missing[int(request_id)]] = (True, folder_id)
+
+    results = []
+    seen = set()
+    for pair in folders:
+        result = resolved.get(pair)
+        if result and pair in seen:
+            result = (False, result[1])
+        seen.add(pair)
+        results.append(result)
+    return results
+
+
+class DriveFolderIndex:
+    """
+    In-memory name -> folder ID index of the subfolders of a set of Drive parent folders.
+
+    Children of every parent are listed once (all pages) when the index is built, so resolving
+    an item's subfolder normally needs no Drive request. Misses fall back to create_drive_folder,
+    which still finds folders created by other containers after the listing, and the result is
+    recorded in the index.
+    """
+
+    def __init__(self, service, parent_folder_ids):
+        import threading
+
+        self.service = service
+        self._lock = threading.Lock()
+        self._folders = {} # parent_id -> {folder name: folder id}
+        for parent_folder_id in parent_folder_ids:
+            if parent_folder_id:
+                self._folders[parent_folder_id] = self._list_child_folders(parent_folder_id)
+
+    def _list_child_folders(self, parent_folder_id):
+        """Lists every (non-trashed) subfolder of a parent, following pagination."""
+        from googleapiclient.errors import HttpError
+
+        query = (
+            f"mimeType = 'application/vnd.google-apps.folder' "
+            f"and '{parent_folder_id}' in parents "
+            f"and trashed = false"
+        )
+        children = {}
+        page_token = None
+        try:
+            while True:
+                response = self.service.files().list(
+                    q=query, fields="nextPageToken, files(id, name)", pageSize=1000, pageToken=page_token
+                ).execute()
+                for folder in response.get("files", []):
+                    children.setdefault(folder["name"], folder["id"])
+                page_token = response.get("nextPageToken")
+                if not page_token:
+                    break
+        except HttpError as error:
+            # Keep what was listed; the remaining folders are resolved through Drive on demand
+            logger.error(f"An error occurred listing subfolders of folder ID {parent_folder_id}: {error}")
+        logger.info(f"Indexed {len(children)} existing subfolders of folder ID {parent_folder_id}")
+        return children
+
+    def resolve(self, folder_name, parent_folder_id):
+        """
+        Returns (created, folder_id) for a subfolder like create_drive_folder, or None on failure.
+        Served from memory when the folder is indexed; otherwise looked up or created in Drive.
+        """
+        with self._lock:
+            folder_id = self._folders.get(parent_folder_id, {}).get(folder_name)
+        if folder_id:
+            logger.debug(f"Folder '{folder_name}' found in index with ID: {folder_id} under parent {parent_folder_id}")
+            return (False, folder_id)
+
+        result = create_drive_folder(self.service, folder_name, parent_folder_id)
+        if result and result[1]:
+            with self._lock:
+                self._folders.setdefault(parent_folder_id, {})[folder_name] = result[1]
+        return result
+
+    def resolve_many(self, folders):
+        """
+        Resolves several (folder_name, parent_folder_id) pairs like resolve, in order.
+        Index misses are looked up and created in Drive together with batch requests.
+        """
+        results = [None] * len(folders)
+        misses = []
+        with self._lock:
+            for i, (folder_name, parent_folder_id) in enumerate(folders):
+                folder_id = self._folders.get(parent_folder_id, {}).get(folder_name)
+                if folder_id:
+                    results[i] = (False, folder_id)
+                else:
+                    misses.append(i)
+        if not misses:
+            return results
+
+        resolved = batch_create_drive_folders(self.service, [folders[i] for i in misses])
+        with self._lock:
+            for i, result in zip(misses, resolved):
+                results[i] = result
+                if result and result[1]:
+                    folder_name, parent_folder_id = folders[i]
+                    self._folders.setdefault(parent_folder_id, {})[folder_name] = result[1]
+        return results
+
+
+def build_drive_service(creds):
+    """Builds the Drive v3 client, honouring DRIVE_API_ENDPOINT when set."""
+    from googleapiclient.discovery import build
+
+    client_options = {"api_endpoint": DRIVE_API_ENDPOINT} if DRIVE_API_ENDPOINT else None
+    return build("drive", "v3", credentials=creds, client_options=client_options)
+
+
+def upload_to_drive(service, folder_id, file_path, http=None, resumable_threshold=None):
+    """
+    Uploads one file into a Drive folder. Returns True on success.
+
+    Args:
+        http: Authorized Http object to execute the request on instead of the service's own
+              (needed when uploading from several threads, as httplib2 is not thread-safe).
+        resumable_threshold: Files up to this size are sent as a single multipart request;
+              larger ones use a resumable session. None always uses a resumable session.
+    """
     from googleapiclient.http import MediaFileUpload
     from googleapiclient.errors import HttpError
     import mimetypes # Use standard library for mime types
@@ -135,29 +386,66 @@ def upload_to_drive(service, folder_id, file_path):
             mime_type = "application/octet-stream" # Generic binary
 
     file_metadata = {"name": file_name, "parents": [folder_id]}
-    media = MediaFileUpload(file_path, mimetype=mime_type, resumable=True)
-
     try:
-        file = (
-            service.files()
-            .create(body=file_metadata, media_body=media, fields="id")
-            .execute()
-        )
+        resumable = resumable_threshold is None or file_path.stat().st_size > resumable_threshold
+        media = MediaFileUpload(file_path, mimetype=mime_type, resumable=resumable)
+        request = service.files().create(body=file_metadata, media_body=media, fields="id")
+        file = request.execute(http=http) if http else request.execute()
         logger.info(f"Uploaded '{file_name}' to folder ID '{folder_id}', file ID '{file.get('id')}'")
         return True
     except Exception as e:
         logger.error(f"An error occurred while uploading '{file_name}': {e}")
         return False 
 
+class DriveUploader:
+    """
+    Uploads files to Drive concurrently on a bounded thread pool.
+
+    httplib2 is not thread-safe, so every worker thread executes its requests on its own
+    authorized Http object (and connection) rather than the shared service's.
+    """
+
+    def __init__(self, service, credentials, workers=UPLOAD_WORKERS, resumable_threshold=RESUMABLE_UPLOAD_THRESHOLD):
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.service = service
+        self.credentials = credentials
+        self.resumable_threshold = resumable_threshold
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="drive-upload")
+        self._local = threading.local()
+
+    def _http(self):
+        http = getattr(self._local, "http", None)
+        if http is None:
+            import httplib2
+            from google_auth_httplib2 import AuthorizedHttp
+
+            http = AuthorizedHttp(self.credentials, http=httplib2.Http())
+            self._local.http = http
+        return http
+
+    def upload(self, folder_id, file_path):
+        return upload_to_drive(self.service, folder_id, file_path, http=self._http(), resumable_threshold=self.resumable_threshold)
+
+    def upload_many(self, folder_id, file_paths):
+        """Uploads files into one folder concurrently. Returns one success flag per file, in order."""
+        return list(self.pool.map(lambda file_path: self.upload(folder_id, file_path), file_paths))
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+
+
 @app.cls(
     gpu=GPU_CONFIG,
     secrets=[modal.Secret.from_name(SECRET_NAME), modal.Secret.from_dotenv()],
     timeout=1800, # 30 minutes timeout per container
+    volumes={str(CONTAINER_CACHE_DIR): cache_volume},
     # max_containers=10, 
     # min_containers=2
     
 )
-class Classifier:
+class Classifier(ClassifierCore):
         
     @modal.enter()
     def start(self): 
@@ -173,138 +461,17 @@ class Classifier:
         if not self.category_folders:
             raise ValueError("Category folder IDs not set in environment. Cannot proceed.")
         
-        self.CATEGORIES = {
-            "opioid_related": [
-                "heroin injection",
-                "fentanyl pills",
-                "oxycodone pills",
-                "opioid overdose",
-                "drugs",
-                "prescription opioid abuse",
-                "illegal opioid sales", 
-                "opioid manufacturing",
-                "counterfeit pills",
-                "opioid crisis",
-                "IV drug use",
-                "black tar heroin",
-                "opioid addiction",
-                "opioid withdrawal",
-                "needle exchange",
-                "opioid death",
-                "naloxone administration",
-                "opioid street price",
-                "opioid trafficking",
-                "pill press",
-                "substance-induced fatality",
-                "prescription medication",
-                "pharmaceutical pills",
-                "drug paraphernalia",
-                "pill bottles",
-                "medicine capsules",
-                "syringes",
-                "drug injection",
-                "controlled substance",
-                "painkillers",
-                "analgesics",
-                "medication storage",
-                "prescription refills",
-                "pharmacy",
-                "doctor's prescription",
-                "medicine cabinet",
-                "first aid kit",
-                "addiction recovery",
-                "rehabilitation center",
-                "sobriety support",
-                "harm reduction",
-                "safe injection",
-                "overdose prevention",
-                "drug education",
-                "addiction treatment",
-                "recovery meeting",
-                "12 step program",
-                "relapse prevention",
-                "drug testing",
-                "clean needle program",
-                "naloxone kit",
-                "medication-assisted treatment",
-                "sober living",
-                "counseling for addiction",
-                "support groups",
-                "detoxification",
-                "intervention",
-                "pill"  
-            ],
-
-            "neutral_content": [
-                "a natural landscape",
-                "food and drink",
-                "people socializing",
-                "pets and animals",
-                "daily activities",
-                "travel photo",
-                "sports and recreation",
-                "technology",
-                "art and creativity",
-                "fashion and style",
-                "vehicles and transportation",
-                "home decoration",
-                "office environment",
-                "a cooking recipe",
-                "fitness exercise",
-                "a news event",
-                "political discussion",
-                "educational material",
-                "a motivational quote",
-                "family gathering",
-                "holiday celebration",
-                "nature photography",
-                "architecture photo",
-                "abstract art", 
-                "advertisement",
-                "promotional material",
-            ]
-        }
-
-        # Generate prompts and map them back to categories *once*
-        self.ALL_PROMPTS = []
-        self.PROMPT_TO_CATEGORY_MAP = []
-        for category, prompts_list in self.CATEGORIES.items():
-            formatted_prompts = [f"a photo of {prompt}" for prompt in prompts_list]
-            self.ALL_PROMPTS.extend(formatted_prompts)
-            self.PROMPT_TO_CATEGORY_MAP.extend([category] * len(prompts_list))
-
-      
+        self.downloads_dir = CONTAINER_DOWNLOADS_DIR
+
         logging.basicConfig(level=log_level, format='%(asctime)s - %(name)s:%(lineno)d - %(levelname)s - %(message)s')
         self.logger = logging.getLogger(__name__) # Use instance logger
         self.logger.info(f"Initializing container on Python {PYTHON_VERSION} with GPU {GPU_CONFIG}...")
 
         import torch
-        import clip
         from google.oauth2 import service_account
-        from googleapiclient.discovery import build
-
-        # Load CLIP model
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.logger.info(f"Using device: {self.device}")
-        try:
-
-            self.model, self.preprocess = clip.load("ViT-B/32", device=self.device) 
-            self.logger.info("CLIP model ViT-B/32 loaded.")
-        except Exception as e:
-            self.logger.exception("Failed to load CLIP model!")
-            raise  # Critical error, stop container initialization
 
-        # Pre-tokenize and encode text prompts
-        try:
-            with torch.no_grad():
-                text_inputs = clip.tokenize(self.ALL_PROMPTS).to(self.device)
-                self.text_features = self.model.encode_text(text_inputs)
-                # Normalize text features once for efficient comparison later
-                self.text_features /= self.text_features.norm(dim=-1, keepdim=True)
-            self.logger.info(f"Encoded {len(self.ALL_PROMPTS)} text prompts.")
-        except Exception as e:
-             self.logger.exception("Failed to encode text prompts!")
-             raise # Critical error
+        self.load_model("cuda" if torch.cuda.is_available() else "cpu", CONTAINER_CACHE_DIR, on_cache_write=cache_volume.commit)
+        self.start_pipeline(CONTAINER_CACHE_DIR)
 
         # Build Google Drive API client using service account from mounted secret
         try:
@@ -312,8 +479,12 @@ class Classifier:
             creds = service_account.Credentials.from_service_account_info(
                 service_account_info, scopes=["https://www.googleapis.com/auth/drive.file"] # Scope for creating files/folders
             )
-            self.drive_service = build("drive", "v3", credentials=creds)
+            self.drive_service = build_drive_service(creds)
+            self.drive_uploader = DriveUploader(self.drive_service, creds)
             self.logger.info("Google Drive service client built successfully.")
+
+            # List the existing item subfolders of every category folder once, instead of per item
+            self.folder_index = DriveFolderIndex(self.drive_service, set(self.category_folders.values()))
         except KeyError:
             self.logger.error(f"SECRET ERROR: 'SERVICE_ACCOUNT_JSON' not found in environment. Ensure Modal secret '{SECRET_NAME}' is populated correctly.")
             raise # Critical error, cannot proceed without Drive access
@@ -322,185 +493,89 @@ class Classifier:
             raise # Critical error
 
 
-    def _analyze_image(self, image_path: Path):
-        """Analyzes a single image using the pre-loaded model and prompts."""
-        import torch
-        from PIL import Image, UnidentifiedImageError
+    def _ensure_item_folder(self, item_dir_name: str, category_folder_id: str):
+        return self.folder_index.resolve(item_dir_name, category_folder_id)
 
-        analyze_start_time = time.time()
-        try:
-            # Open and preprocess the image
-            image = Image.open(image_path).convert('RGB')
-            image_input = self.preprocess(image).unsqueeze(0).to(self.device)
-
-            with torch.no_grad():
-
-                image_features = self.model.encode_image(image_input)
-                image_features /= image_features.norm(dim=-1, keepdim=True)
-
-                # Calculate similarities with pre-computed, normalized text features
-                # (100.0 * image_features @ self.text_features.T) gives logits
-                # softmax converts logits to probabilities
-                similarities = (100.0 * image_features @ self.text_features.T).softmax(dim=-1)
-                scores = similarities.cpu().numpy()[0] # Get scores array for the single image
-
-            # Aggregate scores per category
-            category_scores = {cat_name: 0.0 for cat_name in self.CATEGORIES.keys()}
-            for i, score in enumerate(scores):
-                category = self.PROMPT_TO_CATEGORY_MAP[i]
-                if category in category_scores: # Ensure mapping is correct
-                     category_scores[category] += score # Sum probabilities for prompts in the same category
-
-            # Determine best category based on highest summed probability
-            if not category_scores: # Should not happen if CATEGORIES is populated
-                 best_category = "error"
-                 self.logger.error(f"No category scores generated for {image_path.name}")
-            else:
-                 best_category = max(category_scores, key=category_scores.get)
-
-            duration = time.time() - analyze_start_time
-            self.logger.debug(f"Image {image_path.name} classified as: {best_category} in {duration:.2f}s. (Scores: { {k: f'{v:.3f}' for k, v in category_scores.items()} })")
-            return best_category
-
-        except UnidentifiedImageError:
-            self.logger.error(f"Cannot identify image file (corrupted or wrong format): {image_path}")
-            return "error"
-        except FileNotFoundError:
-             self.logger.error(f"Image file not found at path: {image_path}")
-             return "error"
-        except Exception as e:
-            self.logger.exception(f"Unexpected error during image analysis for {image_path}: {e}")
-            return "error"
+    def _ensure_item_folders(self, folders: List[tuple]) -> list:
+        return self.folder_index.resolve_many(folders)
 
-    @modal.method()
-    def process_item(self, item_dir_name: str):
+    def _upload_file(self, folder_id: str, file_path: Path) -> bool:
+        return self.drive_uploader.upload(folder_id, file_path)
+
+    def _upload_files(self, folder_id: str, file_paths: List[Path]) -> List[bool]:
+        return self.drive_uploader.upload_many(folder_id, file_paths)
+
+    @modal.batched(max_batch_size=BATCH_SIZE, wait_ms=BATCH_WAIT_MS)
+    def process_item(self, item_dir_names: List[str]) -> List[dict]:
         """
-        Processes a single item directory: finds image, classifies, uploads all files.
-        Designed to be called via .map().
+        Processes item directories: finds images, classifies, uploads all files.
+        Designed to be called via .map() with one item directory name per input.
+
+        Modal queues the inputs that reach this container and flushes them here as a
+        list once BATCH_SIZE inputs are waiting or BATCH_WAIT_MS has elapsed, so the
+        images of the whole batch are decoded and encoded together.
 
         Args:
-            item_dir_name: The name of the subdirectory within CONTAINER_DOWNLOADS_DIR to process.
+            item_dir_names: Names of subdirectories within CONTAINER_DOWNLOADS_DIR to process.
 
         Returns:
-            A dictionary summarizing the processing result for this item.
+            One dictionary per input, in order, summarizing the processing result for that item.
         """
         if not self.drive_service:
-             msg = f"Skipping item '{item_dir_name}' due to missing Google Drive service in container."
+             msg = "Skipping item due to missing Google Drive service in container."
              self.logger.error(msg)
-             return {"item": item_dir_name, "status": "error", "reason": msg}
+             return [{"item": name, "status": "error", "reason": msg} for name in item_dir_names]
         if not self.category_folders:
-             msg = f"Skipping item '{item_dir_name}' due to missing category folder configuration."
+             msg = "Skipping item due to missing category folder configuration."
              self.logger.error(msg)
-             return {"item": item_dir_name, "status": "error", "reason": msg}
+             return [{"item": name, "status": "error", "reason": msg} for name in item_dir_names]
 
+        return self.process_items(item_dir_names)
 
-        item_start_time = time.time()
-        item_path = CONTAINER_DOWNLOADS_DIR / item_dir_name
-        self.logger.info(f"Processing item directory: {item_path}")
+    @modal.exit()
+    def stop(self):
+        self.close_pipeline()
+        self.drive_uploader.close()
 
-        image_path = None
-        files_to_upload = []
-        category = "error" # Default category if issues arise early
-        target_category_folder_id = self.category_folders.get("error") # Default GDrive target
+        # Persist this container's embedding shard so re-scoring runs can see it
+        try:
+            cache_volume.commit()
+        except Exception as e:
+            self.logger.warning(f"Failed to commit cache volume on shutdown: {e}")
 
-        if not item_path.is_dir():
-            msg = f"Item path is not a directory: {item_path}. Skipping."
-            self.logger.warning(msg)
-            return {"item": item_dir_name, "status": "skipped", "reason": msg}
 
-        # Find the first image file and collect all files for upload
-        try:
-            for file in item_path.iterdir():
-                if file.is_file():
-                    files_to_upload.append(file)
-                    # Find the first image based on common extensions (case-insensitive)
-                    if file.suffix.lower() in [".jpg", ".jpeg", ".png", ".webp", ".bmp"] and image_path is None:
-                        image_path = file
-                        self.logger.debug(f"Found image file: {file.name}")
-            if not files_to_upload:
-                self.logger.warning(f"No files found in directory: {item_path}")
-                # Decide if this is an error or just skippable
-                return {"item": item_dir_name, "status": "skipped", "reason": "No files in directory"}
+@app.function(volumes={str(CONTAINER_CACHE_DIR): cache_volume}, timeout=1800)
+def rescore_embeddings():
+    """
+    Re-classifies every post with stored image embeddings against the current CATEGORIES prompts.
+
+    No image is decoded and no GPU is needed: the corpus is scored with a matrix multiply
+    of the stored embeddings against the (cached) normalized text features.
+
+    Returns:
+        A dictionary mapping item directory names to their post-level category.
+    """
+    rescore_logger = logging.getLogger("rescore")
+    rescore_logger.setLevel(log_level)
+    rescore_start_time = time.time()
+
+    all_prompts, prompt_to_category_map = build_prompts(CATEGORIES)
+    text_features = get_text_features(all_prompts, "cpu", CONTAINER_CACHE_DIR, on_cache_write=cache_volume.commit).float().numpy()
+
+    store = EmbeddingStore(image_embedding_dir(CONTAINER_CACHE_DIR, CLIP_MODEL_NAME), dim=text_features.shape[1])
+    keys, embeddings = store.matrix()
+    category_names = list(CATEGORIES.keys())
+    scores = score_embeddings(embeddings, text_features, prompt_to_category_map, category_names)
+
+    # Keys are '<item>/<image>' and sorted, so each post's images are contiguous rows
+    item_rows = {}
+    for row, key in enumerate(keys):
+        item_rows.setdefault(key.split("/", 1)[0], []).append(row)
+    rescored = {item: reduce_post_scores(scores[rows], category_names) for item, rows in item_rows.items()}
+
+    rescore_logger.info(f"Re-scored {len(rescored)} posts from {len(keys)} stored image embeddings in {time.time() - rescore_start_time:.2f} seconds.")
+    return rescored
 
-        except Exception as e:
-            self.logger.exception(f"Error scanning files in {item_path}: {e}")
-            # Treat as error, attempt upload to error folder
-            category = "error"
-            target_category_folder_id = self.category_folders.get("error")
-            return
-        else:
-            if not image_path:
-                self.logger.warning(f"No image file found in {item_path}. Classifying item as 'error'.")
-                category = "error"
-            else:
-                # Analyze the found image
-                category = self._analyze_image(image_path) # Returns 'error' on failure
-
-            # Get the Google Drive folder ID for the determined category
-            target_category_folder_id = self.category_folders.get(category)
-            if not target_category_folder_id:
-                self.logger.error(f"CRITICAL: No GDrive folder ID configured for category '{category}'. Uploading to error folder ID {self.category_folders.get('error')} instead.")
-                target_category_folder_id = self.category_folders.get("error") # Fallback to error folder
-                # If even the error folder ID is missing (checked in __enter__), we have a bigger problem
-                if not target_category_folder_id:
-                    msg = f"Cannot upload '{item_dir_name}', target category '{category}' AND error folder IDs are missing."
-                    self.logger.critical(msg)
-                    return {"item": item_dir_name, "status": "error", "reason": msg}
-                
-      
-
-        # Create the specific subfolder for this item within the category folder
-        # Use item_dir_name(shortcode) as the subfolder name in Google Drive
-        new_folder , destination_subfolder_id = create_drive_folder(self.drive_service, item_dir_name, target_category_folder_id)
-      
-        if not new_folder:
-            existing_folder_id = destination_subfolder_id
-            self.logger.info(f"Item folder '{item_dir_name}' already exists in category '{category}' (ID: {existing_folder_id}). Skipping upload.")
-            item_duration = time.time() - item_start_time # Include classification time if done above
-            return {
-                "item": item_dir_name,
-                "status": "skipped_exist", # New status
-                "category": category,
-                "reason": "Subfolder already exists in Google Drive",
-                "duration_seconds": round(item_duration, 2)
-             }
-   
-        #fatal error 
-        if not destination_subfolder_id:
-            self.logger.error(f"Failed to create or find destination subfolder '{item_dir_name}' in category folder ID {target_category_folder_id}. Attempting upload to category folder root.")
-            return 
-            
-
-        # Upload all collected files to the determined destination folder
-        upload_count = 0
-        upload_errors = 0
-        if files_to_upload:
-             self.logger.info(f"Uploading {len(files_to_upload)} files for '{item_dir_name}' to Drive folder ID {destination_subfolder_id} (Category: {category})")
-             for file_path in files_to_upload:
-                 file_id = upload_to_drive(self.drive_service, destination_subfolder_id, file_path)
-                 if file_id:
-                      upload_count += 1
-                 else:
-                      upload_errors += 1
-                      self.logger.warning(f"Failed to upload file: {file_path.name}")
-
-             self.logger.info(f"Finished uploading for '{item_dir_name}'. Success: {upload_count}, Errors: {upload_errors}")
-    
-        item_duration = time.time() - item_start_time
-        final_status = "processed" if upload_errors == 0 else "processed_with_errors"
-        if upload_count == 0 and upload_errors > 0:
-             final_status = "error" # Treat as error if nothing could be uploaded
-
-
-        return {
-            "item": item_dir_name,
-            "status": final_status,
-            "category": category,
-            "files_found": len(files_to_upload),
-            "uploads_successful": upload_count,
-            "upload_errors": upload_errors,
-            "duration_seconds": round(item_duration, 2)
-        }
 #(Run Once locally)
 # Ensures the main GDrive folder exists before starting parallel processing.
 
@@ -520,7 +595,6 @@ def setup_drive_folders(req_parent_folder_id: str = None):
 
     import json
     from google.oauth2 import service_account
-    from googleapiclient.discovery import build
 
     parent_folder_id_to_use = req_parent_folder_id if req_parent_folder_id else GDRIVE_PARENT_FOLDER_ID
     setup_logger.info(f"Running setup. Target root folder name: '{ROOT_FOLDER_NAME}'. Parent ID: {parent_folder_id_to_use or 'My Drive root'}")
@@ -532,7 +606,7 @@ def setup_drive_folders(req_parent_folder_id: str = None):
         creds = service_account.Credentials.from_service_account_info(
             service_account_info, scopes=["https://www.googleapis.com/auth/drive.file"]
         )
-        service = build("drive", "v3", credentials=creds)
+        service = build_drive_service(creds)
         setup_logger.info("Google Drive service client built for setup.")
     except KeyError:
          setup_logger.error(f"SECRET ERROR: 'SERVICE_ACCOUNT_JSON' not found in environment for setup function. Ensure Modal secret '{SECRET_NAME}' is correct.")
@@ -553,16 +627,13 @@ def setup_drive_folders(req_parent_folder_id: str = None):
     parent_classification_folder_id = storage_folder_id
 
 
-    CATEGORY_DRIVE_NAMES = {
-        "opioid_related": "Opioid Related",
-        "neutral_content": "Neutral Content",
-        "error": "Processing Errors" # Folder for items that fail processing
-    }
-
     category_folders = {}
     logger.info(f"Ensuring category folders exist under parent folder ID: {parent_classification_folder_id}")
-    for category_key, drive_folder_name in CATEGORY_DRIVE_NAMES.items():
-        new_folder, folder_id = create_drive_folder(service, drive_folder_name, parent_classification_folder_id)
+    category_results = batch_create_drive_folders(
+        service, [(drive_folder_name, parent_classification_folder_id) for drive_folder_name in CATEGORY_FOLDER_NAMES.values()]
+    )
+    for (category_key, drive_folder_name), result in zip(CATEGORY_FOLDER_NAMES.items(), category_results):
+        new_folder, folder_id = result or (False, None)
         if folder_id and new_folder :
             category_folders[category_key] = folder_id
             with open(".env", "a") as f:
@@ -582,11 +653,24 @@ def setup_drive_folders(req_parent_folder_id: str = None):
 # --- Main Application Entrypoint ---
 
 @app.local_entrypoint()
-def main(drive_parent_id: str = None): # Allow overriding parent ID via CLI flag e.g. --drive-parent-id "..." useful for readme and deploying
+def main(drive_parent_id: str = None, rescore: bool = False): # Allow overriding parent ID via CLI flag e.g. --drive-parent-id "..." useful for readme and deploying
     """
     Main entry point: Sets up Drive, lists items, runs parallel classification.
+    With --rescore, only re-classifies the stored image embeddings against the current prompts.
     """
     run_start_time = time.time()
+
+    if rescore:
+        logger.info("--- Re-scoring stored image embeddings against current prompts ---")
+        rescored = rescore_embeddings.remote()
+        with open("rescored_categories.json", "w", encoding="utf-8") as f:
+            json.dump(rescored, f, indent=2)
+        category_counts = {}
+        for category in rescored.values():
+            category_counts[category] = category_counts.get(category, 0) + 1
+        logger.info(f"Re-scored {len(rescored)} posts: {category_counts}. Results written to rescored_categories.json")
+        logger.info(f"Total job duration: {time.time() - run_start_time:.2f} seconds.")
+        return
     # Use the explicitly passed CLI flag highest precedence, then .env var, then None
     parent_id_for_setup = drive_parent_id if drive_parent_id else GDRIVE_PARENT_FOLDER_ID
 
@@ -658,21 +742,7 @@ def main(drive_parent_id: str = None): # Allow overriding parent ID via CLI flag
     logger.info(f"Step 3 Complete. Parallel processing finished in {map_duration:.2f} seconds.")
 
     # 5. Summarize Results
-    logger.info("--- Job Summary ---")
-    processed_ok = sum(1 for r in results if isinstance(r, dict) and r.get("status") == "processed")
-    processed_w_errors = sum(1 for r in results if isinstance(r, dict) and r.get("status") == "processed_with_errors")
-    errors = sum(1 for r in results if isinstance(r, dict) and r.get("status") == "error")
-    framework_errors = sum(1 for r in results if isinstance(r, dict) and r.get("status") == "framework_error")
-    skipped = sum(1 for r in results if isinstance(r, dict) and r.get("status") == "skipped")
-    unknown = len(results) - (processed_ok + processed_w_errors + errors + framework_errors + skipped)
-
-    logger.info(f"Total items processed: {len(results)} / {len(items_to_process)}")
-    logger.info(f"  Processed successfully: {processed_ok}")
-    logger.info(f"  Processed with upload errors: {processed_w_errors}")
-    logger.info(f"  Skipped (e.g., not dir, no files): {skipped}")
-    logger.info(f"  Processing errors (classification/scan): {errors}")
-    logger.info(f"  Framework/Container errors: {framework_errors}")
-    if unknown > 0: logger.warning(f"  Unknown result status: {unknown}")
+    log_job_summary(results, len(items_to_process))
 
     total_duration = time.time() - run_start_time
     logger.info(f"Total job duration: {total_duration:.2f} seconds.")
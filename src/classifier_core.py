@@ -0,0 +1,627 @@
+import os
+import json
+import time
+import hashlib
+import logging
+from pathlib import Path
+from typing import Callable, List, Optional
+from embedding_store import EmbeddingStore
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = [".jpg", ".jpeg", ".png", ".webp", ".bmp"]
+
+CLIP_MODEL_NAME = os.environ.get("CLIP_MODEL_NAME", "ViT-B/32")
+
+# Decode/preprocess pipeline: images are decoded on DECODE_WORKERS threads, up to
+# PREFETCH_CHUNKS chunks of INFERENCE_CHUNK_SIZE images ahead of the model.
+DECODE_WORKERS = int(os.environ.get("CLASSIFIER_DECODE_WORKERS", str(os.cpu_count() or 4)))
+
+PREFETCH_CHUNKS = int(os.environ.get("CLASSIFIER_PREFETCH_CHUNKS", "2"))
+
+INFERENCE_CHUNK_SIZE = int(os.environ.get("CLASSIFIER_INFERENCE_CHUNK_SIZE", "8"))
+
+# How the per-image category scores of a multi-image (carousel) post become the post's category:
+#   "max"  - best category by its highest score on any image
+#   "mean" - best category by its average score over all images
+#   "any"  - first category (in CATEGORIES order) scoring at least POST_THRESHOLD on any image, else "mean"
+POST_REDUCTION = os.environ.get("CLASSIFIER_POST_REDUCTION", "max").lower()
+
+POST_THRESHOLD = float(os.environ.get("CLASSIFIER_POST_THRESHOLD", "0.5"))
+
+# Folder name of each category at the destination (Google Drive or a local output directory)
+CATEGORY_FOLDER_NAMES = {
+    "opioid_related": "Opioid Related",
+    "neutral_content": "Neutral Content",
+    "error": "Processing Errors" # Folder for items that fail processing
+}
+
+# Text prompts per category. Changing them invalidates the text feature cache automatically.
+CATEGORIES = {
+    "opioid_related": [
+        "heroin injection",
+        "fentanyl pills",
+        "oxycodone pills",
+        "opioid overdose",
+        "drugs",
+        "prescription opioid abuse",
+        "illegal opioid sales", 
+        "opioid manufacturing",
+        "counterfeit pills",
+        "opioid crisis",
+        "IV drug use",
+        "black tar heroin",
+        "opioid addiction",
+        "opioid withdrawal",
+        "needle exchange",
+        "opioid death",
+        "naloxone administration",
+        "opioid street price",
+        "opioid trafficking",
+        "pill press",
+        "substance-induced fatality",
+        "prescription medication",
+        "pharmaceutical pills",
+        "drug paraphernalia",
+        "pill bottles",
+        "medicine capsules",
+        "syringes",
+        "drug injection",
+        "controlled substance",
+        "painkillers",
+        "analgesics",
+        "medication storage",
+        "prescription refills",
+        "pharmacy",
+        "doctor's prescription",
+        "medicine cabinet",
+        "first aid kit",
+        "addiction recovery",
+        "rehabilitation center",
+        "sobriety support",
+        "harm reduction",
+        "safe injection",
+        "overdose prevention",
+        "drug education",
+        "addiction treatment",
+        "recovery meeting",
+        "12 step program",
+        "relapse prevention",
+        "drug testing",
+        "clean needle program",
+        "naloxone kit",
+        "medication-assisted treatment",
+        "sober living",
+        "counseling for addiction",
+        "support groups",
+        "detoxification",
+        "intervention",
+        "pill"  
+    ],
+
+    "neutral_content": [
+        "a natural landscape",
+        "food and drink",
+        "people socializing",
+        "pets and animals",
+        "daily activities",
+        "travel photo",
+        "sports and recreation",
+        "technology",
+        "art and creativity",
+        "fashion and style",
+        "vehicles and transportation",
+        "home decoration",
+        "office environment",
+        "a cooking recipe",
+        "fitness exercise",
+        "a news event",
+        "political discussion",
+        "educational material",
+        "a motivational quote",
+        "family gathering",
+        "holiday celebration",
+        "nature photography",
+        "architecture photo",
+        "abstract art", 
+        "advertisement",
+        "promotional material",
+    ]
+}
+
+
+
+def text_feature_cache_path(cache_dir: Path, model_name: str, prompts: List[str]) -> Path:
+    """Returns the cache file for a model/prompt-list pair. Any change to the prompts yields a new file."""
+    prompts_hash = hashlib.sha256(json.dumps(prompts).encode("utf-8")).hexdigest()[:16]
+    safe_model_name = model_name.replace("/", "-")
+    return cache_dir / "text_features" / f"{safe_model_name}-{prompts_hash}.npy"
+
+
+def load_text_features(cache_path: Path):
+    """Memory-maps cached normalized text features, or returns None if the cache is missing or unreadable."""
+    import numpy as np
+
+    try:
+        return np.load(cache_path, mmap_mode="r")
+    except FileNotFoundError:
+        return None
+    except (ValueError, OSError) as e:
+        logger.warning(f"Ignoring unreadable text feature cache {cache_path}: {e}")
+        return None
+
+
+def save_text_features(cache_path: Path, text_features) -> None:
+    """Writes normalized text features atomically so concurrent containers never read a partial file."""
+    import numpy as np
+
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, text_features)
+    os.replace(tmp_path, cache_path)
+
+
+def image_embedding_dir(cache_dir: Path, model_name: str) -> Path:
+    """Returns the embedding store directory for a model; embeddings of different models never mix."""
+    return cache_dir / "image_embeddings" / model_name.replace("/", "-")
+
+
+def build_prompts(categories):
+    """Formats the category prompts and returns (all_prompts, prompt_to_category_map)."""
+    all_prompts = []
+    prompt_to_category_map = []
+    for category, prompts_list in categories.items():
+        formatted_prompts = [f"a photo of {prompt}" for prompt in prompts_list]
+        all_prompts.extend(formatted_prompts)
+        prompt_to_category_map.extend([category] * len(prompts_list))
+    return all_prompts, prompt_to_category_map
+
+
+def get_text_features(prompts: List[str], device: str, cache_dir: Path, model=None, on_cache_write: Optional[Callable[[], None]] = None):
+    """
+    Returns normalized text features for the prompts as a tensor on `device`.
+
+    Loaded from `cache_dir` when the model/prompt pair was encoded before, otherwise encoded
+    with `model` (loaded on demand if not given) and written back to the cache, after which
+    `on_cache_write` is called (e.g. to commit a Modal volume).
+    """
+    import torch
+    import clip
+    import numpy as np
+
+    cache_path = text_feature_cache_path(cache_dir, CLIP_MODEL_NAME, prompts)
+    cached_features = load_text_features(cache_path)
+    if cached_features is not None and cached_features.shape[0] == len(prompts):
+        logger.info(f"Loaded {len(prompts)} encoded text prompts from cache {cache_path}.")
+        return torch.from_numpy(np.array(cached_features)).to(device)
+
+    if model is None:
+        model, _ = clip.load(CLIP_MODEL_NAME, device=device)
+
+    # Pre-tokenize and encode text prompts
+    with torch.no_grad():
+        text_inputs = clip.tokenize(prompts).to(device)
+        text_features = model.encode_text(text_inputs)
+        # Normalize text features once for efficient comparison later
+        text_features /= text_features.norm(dim=-1, keepdim=True)
+    logger.info(f"Encoded {len(prompts)} text prompts.")
+
+    # A cache write failure only costs the next run a re-encode
+    try:
+        save_text_features(cache_path, text_features.float().cpu().numpy())
+        if on_cache_write:
+            on_cache_write()
+        logger.info(f"Cached encoded text prompts at {cache_path}.")
+    except Exception as e:
+        logger.warning(f"Failed to cache encoded text prompts at {cache_path}: {e}")
+    return text_features
+
+
+
+def reduce_post_scores(image_scores, category_names: List[str], rule: str = POST_REDUCTION, threshold: float = POST_THRESHOLD) -> str:
+    """
+    Reduces the (images, categories) score matrix of one post to the post's category.
+
+    Args:
+        image_scores: Per-image category scores (summed prompt probabilities), one row per image.
+        category_names: Category of each score column.
+        rule: "max", "mean" or "any" (any-over-threshold), see POST_REDUCTION.
+        threshold: Score an image must reach for the "any" rule to flag its category.
+    """
+    import numpy as np
+
+    image_scores = np.asarray(image_scores, dtype=np.float32)
+    if rule == "max":
+        return category_names[int(image_scores.max(axis=0).argmax())]
+    if rule == "any":
+        flagged = (image_scores >= threshold).any(axis=0)
+        if flagged.any():
+            return category_names[int(flagged.argmax())]
+    elif rule != "mean":
+        raise ValueError(f"Unknown post reduction rule '{rule}'. Expected 'max', 'mean' or 'any'.")
+    return category_names[int(image_scores.mean(axis=0).argmax())]
+
+
+class ClassifierCore:
+    """
+    Model loading, batch classification and per-item routing shared by the Modal and local backends.
+
+    Subclasses set `downloads_dir` and `category_folders` and implement the destination hooks
+    `_ensure_item_folder` and `_upload_file`.
+    """
+
+    logger = logger
+    downloads_dir: Path
+    category_folders: dict
+
+    def load_model(self, device: str, cache_dir: Path, on_cache_write: Optional[Callable[[], None]] = None):
+        """Loads CLIP, the (cached) text features and the prompt->category matrix onto `device`."""
+        import torch
+        import clip
+
+        if POST_REDUCTION not in ("max", "mean", "any"):
+            raise ValueError(f"CLASSIFIER_POST_REDUCTION must be 'max', 'mean' or 'any', got '{POST_REDUCTION}'.")
+
+        self.CATEGORIES = CATEGORIES
+
+        # Generate prompts and map them back to categories *once*
+        self.ALL_PROMPTS, self.PROMPT_TO_CATEGORY_MAP = build_prompts(self.CATEGORIES)
+
+        # Load CLIP model
+        self.device = device
+        self.logger.info(f"Using device: {self.device}")
+        try:
+
+            self.model, self.preprocess = clip.load(CLIP_MODEL_NAME, device=self.device) 
+            self.logger.info(f"CLIP model {CLIP_MODEL_NAME} loaded.")
+        except Exception as e:
+            self.logger.exception("Failed to load CLIP model!")
+            raise  # Critical error, stop container initialization
+
+        # Load normalized text features from the cache, or encode and cache them
+        try:
+            self.text_features = get_text_features(self.ALL_PROMPTS, self.device, cache_dir, self.model, on_cache_write).to(dtype=self.model.dtype)
+        except Exception as e:
+             self.logger.exception("Failed to encode text prompts!")
+             raise # Critical error
+
+        # One-hot prompt->category matrix so per-category sums are a single matmul:
+        # (batch, prompts) @ (prompts, categories) -> (batch, categories)
+        self.CATEGORY_NAMES = list(self.CATEGORIES.keys())
+        category_index = torch.tensor([self.CATEGORY_NAMES.index(category) for category in self.PROMPT_TO_CATEGORY_MAP])
+        self.prompt_category_matrix = torch.nn.functional.one_hot(category_index, num_classes=len(self.CATEGORY_NAMES)).to(
+            device=self.device, dtype=self.text_features.dtype
+        )
+
+    def start_pipeline(self, cache_dir: Path, decode_workers: int = DECODE_WORKERS):
+        """
+        Starts the decode thread pool and opens this process's embedding store shard.
+
+        Kept separate from load_model so a forking backend can load the model once in the
+        parent and start threads and shards only in the worker processes.
+        """
+        from image_pipeline import ImagePrefetcher
+
+        # Decode and preprocess images on a thread pool ahead of inference
+        self.prefetcher = ImagePrefetcher(self.preprocess, workers=decode_workers, prefetch_batches=PREFETCH_CHUNKS, pin_memory=self.device == "cuda")
+
+        # Image embeddings persisted in the cache for re-scoring without re-inference
+        self.embedding_store = EmbeddingStore(image_embedding_dir(cache_dir, CLIP_MODEL_NAME), dim=self.text_features.shape[1])
+
+    def close_pipeline(self):
+        self.prefetcher.close()
+        self.logger.info(
+            f"Decode pipeline totals: decode waited {self.prefetcher.decode_wait_seconds:.2f}s on the model, "
+            f"model waited {self.prefetcher.model_wait_seconds:.2f}s on decode."
+        )
+
+    def _analyze_image(self, image_path: Path):
+        """Analyzes a single image using the pre-loaded model and prompts."""
+        return self._analyze_images([image_path])[0]
+
+    def _analyze_images(self, image_paths: List[Path]) -> List[str]:
+        """Returns the best category of each image, in order ('error' for images that could not be scored)."""
+        return [
+            "error" if scores is None else self.CATEGORY_NAMES[int(scores.argmax())]
+            for scores in self._score_images(image_paths)
+        ]
+
+    def _score_images(self, image_paths: List[Path]) -> list:
+        """
+        Scores a batch of images, overlapping image decoding with inference.
+
+        Returns one array of per-category scores per input path, in order. Images that
+        cannot be opened get None without failing the rest of the batch.
+        Images already in the embedding store (unchanged since they were encoded)
+        are not decoded again; newly encoded ones are appended to it.
+        """
+        import torch
+        import numpy as np
+
+        analyze_start_time = time.time()
+        image_scores = [None] * len(image_paths)
+
+        stored_embeddings = []
+        stored_indices = []
+        decode_indices = []
+        for i, image_path in enumerate(image_paths):
+            stored = self.embedding_store.lookup(image_path)
+            if stored is not None:
+                stored_embeddings.append(stored)
+                stored_indices.append(i)
+            else:
+                decode_indices.append(i)
+
+        decode_wait_start = self.prefetcher.decode_wait_seconds
+        model_wait_start = self.prefetcher.model_wait_seconds
+        try:
+            with torch.no_grad():
+                # The prefetcher decodes the next chunks on its thread pool while the current one is encoded
+                new_feature_batches = []
+                new_indices = []
+                for chunk_indices, image_input in self.prefetcher.batches([image_paths[i] for i in decode_indices], INFERENCE_CHUNK_SIZE):
+                    image_input = image_input.to(self.device, non_blocking=True)
+                    chunk_features = self.model.encode_image(image_input)
+                    chunk_features /= chunk_features.norm(dim=-1, keepdim=True)
+                    new_feature_batches.append(chunk_features)
+                    new_indices.extend(decode_indices[j] for j in chunk_indices)
+
+                feature_batches = list(new_feature_batches)
+                if stored_embeddings:
+                    feature_batches.append(torch.from_numpy(np.stack(stored_embeddings)).to(self.device, dtype=self.text_features.dtype))
+                if not feature_batches:
+                    return image_scores
+                image_features = torch.cat(feature_batches)
+                batch_indices = new_indices + stored_indices
+
+                # Calculate similarities with pre-computed, normalized text features
+                # (100.0 * image_features @ self.text_features.T) gives logits
+                # softmax converts logits to probabilities
+                similarities = (100.0 * image_features @ self.text_features.T).softmax(dim=-1)
+
+                # Sum probabilities for prompts in the same category
+                category_scores = similarities @ self.prompt_category_matrix
+                category_scores = category_scores.float().cpu().numpy() # One device->host sync for the whole batch
+        except Exception as e:
+            self.logger.exception(f"Unexpected error during batch image analysis of {len(image_paths)} images: {e}")
+            return image_scores
+
+        if new_feature_batches:
+            # Persist new embeddings so prompt changes can be re-scored without re-inference
+            try:
+                self.embedding_store.append([image_paths[i] for i in new_indices], torch.cat(new_feature_batches).cpu().numpy())
+            except Exception as e:
+                self.logger.warning(f"Failed to store image embeddings: {e}")
+
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        for row, i in enumerate(batch_indices):
+            image_scores[i] = category_scores[row]
+            if debug:
+                scores = {name: f"{score:.3f}" for name, score in zip(self.CATEGORY_NAMES, category_scores[row])}
+                self.logger.debug(f"Image {image_paths[i].name} scored: {scores}")
+
+        duration = time.time() - analyze_start_time
+        decode_wait = self.prefetcher.decode_wait_seconds - decode_wait_start
+        model_wait = self.prefetcher.model_wait_seconds - model_wait_start
+        self.logger.info(
+            f"Scored batch of {len(batch_indices)} images ({len(stored_indices)} from stored embeddings) in {duration:.2f}s. "
+            f"Decode waited {decode_wait:.2f}s on the model, model waited {model_wait:.2f}s on decode."
+        )
+        return image_scores
+
+    def _scan_item(self, item_dir_name: str):
+        """
+        Collects the files of an item directory and the images to classify.
+
+        Returns:
+            (files_to_upload, image_paths) on success, or a result dictionary if the
+            item cannot be processed further. Multi-image (carousel) posts yield all
+            of their images, in file name order.
+        """
+        item_path = self.downloads_dir / item_dir_name
+        self.logger.info(f"Processing item directory: {item_path}")
+
+        image_paths = []
+        files_to_upload = []
+
+        if not item_path.is_dir():
+            msg = f"Item path is not a directory: {item_path}. Skipping."
+            self.logger.warning(msg)
+            return {"item": item_dir_name, "status": "skipped", "reason": msg}
+
+        # Find every image file and collect all files for upload
+        try:
+            for file in sorted(item_path.iterdir()):
+                if file.is_file():
+                    files_to_upload.append(file)
+                    # Find images based on common extensions (case-insensitive)
+                    if file.suffix.lower() in IMAGE_EXTENSIONS:
+                        image_paths.append(file)
+                        self.logger.debug(f"Found image file: {file.name}")
+            if not files_to_upload:
+                self.logger.warning(f"No files found in directory: {item_path}")
+                # Decide if this is an error or just skippable
+                return {"item": item_dir_name, "status": "skipped", "reason": "No files in directory"}
+
+        except Exception as e:
+            self.logger.exception(f"Error scanning files in {item_path}: {e}")
+            return {"item": item_dir_name, "status": "error", "reason": f"Error scanning files: {e}"}
+
+        if not image_paths:
+            self.logger.warning(f"No image file found in {item_path}. Classifying item as 'error'.")
+
+        return files_to_upload, image_paths
+
+    def _ensure_item_folder(self, item_dir_name: str, category_folder_id: str):
+        """
+        Finds or creates the item's folder inside a category folder.
+
+        Returns:
+            (created, folder_id), or None on failure.
+        """
+        raise NotImplementedError
+
+    def _ensure_item_folders(self, folders: List[tuple]) -> list:
+        """
+        Finds or creates the folders of several items at once.
+
+        Args:
+            folders: (item_dir_name, category_folder_id) pairs.
+
+        Returns:
+            One _ensure_item_folder result per pair, in order. Backends may override to batch requests.
+        """
+        return [self._ensure_item_folder(item_dir_name, category_folder_id) for item_dir_name, category_folder_id in folders]
+
+    def _upload_file(self, folder_id: str, file_path: Path) -> bool:
+        """Stores one file of an item in its destination folder. Returns True on success."""
+        raise NotImplementedError
+
+    def _upload_files(self, folder_id: str, file_paths: List[Path]) -> List[bool]:
+        """Stores all files of an item, one success flag per file. Backends may override to upload concurrently."""
+        return [self._upload_file(folder_id, file_path) for file_path in file_paths]
+
+    def _category_folder_id(self, item_dir_name: str, category: str):
+        """
+        Returns the destination folder ID for the determined category, falling back to the
+        error folder, or a result dictionary if neither is configured.
+        """
+        target_category_folder_id = self.category_folders.get(category)
+        if not target_category_folder_id:
+            self.logger.error(f"CRITICAL: No GDrive folder ID configured for category '{category}'. Uploading to error folder ID {self.category_folders.get('error')} instead.")
+            target_category_folder_id = self.category_folders.get("error") # Fallback to error folder
+            # If even the error folder ID is missing (checked in __enter__), we have a bigger problem
+            if not target_category_folder_id:
+                msg = f"Cannot upload '{item_dir_name}', target category '{category}' AND error folder IDs are missing."
+                self.logger.critical(msg)
+                return {"item": item_dir_name, "status": "error", "reason": msg}
+        return target_category_folder_id
+
+    def _route_item(self, item_dir_name: str, category: str, files_to_upload: List[Path], item_start_time: float,
+                    target_category_folder_id: str, folder):
+        """
+        Uploads all files of an item into its subfolder under its category folder.
+
+        `folder` is the item's (created, folder_id) subfolder from _ensure_item_folder(s), or None
+        if it could not be found or created.
+        """
+
+        #fatal error 
+        if not folder or not folder[1]:
+            msg = f"Failed to create or find destination subfolder '{item_dir_name}' in category folder ID {target_category_folder_id}."
+            self.logger.error(msg)
+            return {"item": item_dir_name, "status": "error", "category": category, "reason": msg}
+
+        new_folder, destination_subfolder_id = folder
+        if not new_folder:
+            existing_folder_id = destination_subfolder_id
+            self.logger.info(f"Item folder '{item_dir_name}' already exists in category '{category}' (ID: {existing_folder_id}). Skipping upload.")
+            item_duration = time.time() - item_start_time # Include classification time if done above
+            return {
+                "item": item_dir_name,
+                "status": "skipped_exist", # New status
+                "category": category,
+                "reason": "Subfolder already exists at destination",
+                "duration_seconds": round(item_duration, 2)
+             }
+
+        # Upload all collected files to the determined destination folder
+        upload_count = 0
+        upload_errors = 0
+        if files_to_upload:
+             self.logger.info(f"Uploading {len(files_to_upload)} files for '{item_dir_name}' to folder ID {destination_subfolder_id} (Category: {category})")
+             for file_path, file_id in zip(files_to_upload, self._upload_files(destination_subfolder_id, files_to_upload)):
+                 if file_id:
+                      upload_count += 1
+                 else:
+                      upload_errors += 1
+                      self.logger.warning(f"Failed to upload file: {file_path.name}")
+
+             self.logger.info(f"Finished uploading for '{item_dir_name}'. Success: {upload_count}, Errors: {upload_errors}")
+    
+        item_duration = time.time() - item_start_time
+        final_status = "processed" if upload_errors == 0 else "processed_with_errors"
+        if upload_count == 0 and upload_errors > 0:
+             final_status = "error" # Treat as error if nothing could be uploaded
+
+
+        return {
+            "item": item_dir_name,
+            "status": final_status,
+            "category": category,
+            "files_found": len(files_to_upload),
+            "uploads_successful": upload_count,
+            "upload_errors": upload_errors,
+            "duration_seconds": round(item_duration, 2)
+        }
+
+    def process_items(self, item_dir_names: List[str]) -> List[dict]:
+        """
+        Processes item directories: finds images, classifies them together, uploads all files.
+
+        Args:
+            item_dir_names: Names of subdirectories within `downloads_dir` to process.
+
+        Returns:
+            One dictionary per input, in order, summarizing the processing result for that item.
+        """
+        results = [None] * len(item_dir_names)
+        scanned = [] # (index, start time, files_to_upload, image_paths)
+        for idx, item_dir_name in enumerate(item_dir_names):
+            item_start_time = time.time()
+            scan_result = self._scan_item(item_dir_name)
+            if isinstance(scan_result, dict):
+                results[idx] = scan_result
+            else:
+                scanned.append((idx, item_start_time, *scan_result))
+
+        # Score every image of every item in the batch at once, then reduce each item's rows
+        # to a post-level category; items without a scorable image stay 'error'
+        all_image_paths = [image_path for entry in scanned for image_path in entry[3]]
+        all_scores = self._score_images(all_image_paths) if all_image_paths else []
+
+        routed = [] # (index, start time, files_to_upload, category, images classified, category folder ID)
+        offset = 0
+        for idx, item_start_time, files_to_upload, image_paths in scanned:
+            item_scores = [scores for scores in all_scores[offset:offset + len(image_paths)] if scores is not None]
+            offset += len(image_paths)
+            category = reduce_post_scores(item_scores, self.CATEGORY_NAMES) if item_scores else "error"
+            if len(image_paths) > 1:
+                self.logger.debug(f"Post '{item_dir_names[idx]}' classified as {category} from {len(item_scores)}/{len(image_paths)} images ({POST_REDUCTION}).")
+
+            target_category_folder_id = self._category_folder_id(item_dir_names[idx], category)
+            if isinstance(target_category_folder_id, dict):
+                results[idx] = target_category_folder_id
+                results[idx]["images_classified"] = len(item_scores)
+            else:
+                routed.append((idx, item_start_time, files_to_upload, category, len(item_scores), target_category_folder_id))
+
+        # Create the specific subfolder for each item within its category folder, all at once
+        # Use item_dir_name(shortcode) as the subfolder name
+        folders = self._ensure_item_folders([(item_dir_names[entry[0]], entry[5]) for entry in routed]) if routed else []
+
+        for (idx, item_start_time, files_to_upload, category, images_classified, target_category_folder_id), folder in zip(routed, folders):
+            results[idx] = self._route_item(item_dir_names[idx], category, files_to_upload, item_start_time, target_category_folder_id, folder)
+            results[idx]["images_classified"] = images_classified
+
+        return results
+
+
+def log_job_summary(results: List[dict], total_items: int) -> None:
+    """Logs the per-status counts of a classification run's result dictionaries."""
+    logger.info("--- Job Summary ---")
+    processed_ok = sum(1 for r in results if isinstance(r, dict) and r.get("status") == "processed")
+    processed_w_errors = sum(1 for r in results if isinstance(r, dict) and r.get("status") == "processed_with_errors")
+    errors = sum(1 for r in results if isinstance(r, dict) and r.get("status") == "error")
+    framework_errors = sum(1 for r in results if isinstance(r, dict) and r.get("status") == "framework_error")
+    skipped = sum(1 for r in results if isinstance(r, dict) and r.get("status") == "skipped")
+    unknown = len(results) - (processed_ok + processed_w_errors + errors + framework_errors + skipped)
+
+    logger.info(f"Total items processed: {len(results)} / {total_items}")
+    logger.info(f"  Processed successfully: {processed_ok}")
+    logger.info(f"  Processed with upload errors: {processed_w_errors}")
+    logger.info(f"  Skipped (e.g., not dir, no files): {skipped}")
+    logger.info(f"  Processing errors (classification/scan): {errors}")
+    logger.info(f"  Framework/Container errors: {framework_errors}")
+    if unknown > 0: logger.warning(f"  Unknown result status: {unknown}")
@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingStore:
+    """
+    Append-only store of normalized CLIP image embeddings.
+
+    Embeddings are stored as raw float16 rows in per-writer shard files (``<shard>.f16``), so
+    concurrent containers never append to the same file. Each shard has a JSON-lines side index
+    (``<shard>.index.jsonl``) mapping an image, identified by its item directory and file name
+    together with the file's mtime and size, to a row of that shard. A later row for the same
+    image supersedes earlier ones.
+    """
+
+    def __init__(self, root: Path, dim: int, shard_id: Optional[str] = None):
+        self.root = Path(root)
+        self.dim = dim
+        self.row_bytes = dim * np.dtype(np.float16).itemsize
+        self.shard_id = shard_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._lock = threading.Lock()
+        self._entries: Dict[str, dict] = {}
+        self._mmaps: Dict[str, np.memmap] = {}
+        self.refresh()
+
+    @staticmethod
+    def make_key(image_path: Path) -> str:
+        """Key of an image: '<item directory>/<file name>'."""
+        image_path = Path(image_path)
+        return f"{image_path.parent.name}/{image_path.name}"
+
+    def _data_path(self, shard: str) -> Path:
+        return self.root / f"{shard}.f16"
+
+    def _index_path(self, shard: str) -> Path:
+        return self.root / f"{shard}.index.jsonl"
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def refresh(self) -> None:
+        """
+        (Re)reads the side index of every shard.
+
+        Index lines that point past the end of their data file, or that were torn by an
+        interrupted write, are ignored.
+        """
+        entries = {}
+        if self.root.is_dir():
+            for index_path in sorted(self.root.glob("*.index.jsonl")):
+                shard = index_path.name[: -len(".index.jsonl")]
+                try:
+                    n_rows = self._data_path(shard).stat().st_size // self.row_bytes
+                except FileNotFoundError:
+                    continue
+                with open(index_path, encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except json.JSONDecodeError:
+                            continue
+                        if record["row"] >= n_rows:
+                            continue
+                        record["shard"] = shard
+                        current = entries.get(record["key"])
+                        if current is None or record["written_at"] >= current["written_at"]:
+                            entries[record["key"]] = record
+
+        with self._lock:
+            self._entries = entries
+            self._mmaps = {}
+        logger.info(f"Embedding store {self.root} has {len(entries)} image embeddings.")
+
+    def _rows(self, shard: str, min_rows: int) -> np.memmap:
+        """Memory-maps a shard, remapping if it has grown since it was last opened."""
+        mmap = self._mmaps.get(shard)
+        if mmap is None or mmap.shape[0] < min_rows:
+            n_rows = self._data_path(shard).stat().st_size // self.row_bytes
+            mmap = np.memmap(self._data_path(shard), dtype=np.float16, mode="r", shape=(n_rows, self.dim))
+            self._mmaps[shard] = mmap
+        return mmap
+
+    def lookup(self, image_path: Path) -> Optional[np.ndarray]:
+        """
+        Returns the stored embedding of an image, or None if it was never stored or the file
+        changed (different mtime or size) since it was encoded.
+        """
+        entry = self._entries.get(self.make_key(image_path))
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return None
+        if entry["mtime_ns"] != stat.st_mtime_ns or entry["size"] != stat.st_size:
+            return None
+        return self._rows(entry["shard"], entry["row"] + 1)[entry["row"]]
+
+    def append(self, image_paths: List[Path], embeddings: np.ndarray) -> None:
+        """Appends one embedding row per image to this writer's shard and records them in its index."""
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float16)
+        if embeddings.shape != (len(image_paths), self.dim):
+            raise ValueError(f"Expected embeddings of shape {(len(image_paths), self.dim)}, got {embeddings.shape}")
+
+        with self._lock:
+            self.root.mkdir(parents=True, exist_ok=True)
+            data_path = self._data_path(self.shard_id)
+
+            with open(data_path, "ab") as f:
+                size = f.seek(0, os.SEEK_END)
+                if size % self.row_bytes:
+                    # Drop a torn row left by an interrupted append so rows stay aligned
+                    size -= size % self.row_bytes
+                    f.truncate(size)
+                start_row = size // self.row_bytes
+                f.write(embeddings.tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+            # The index is written after the data, so it never references rows that do not exist
+            written_at = time.time()
+            records = []
+            for offset, image_path in enumerate(image_paths):
+                stat = os.stat(image_path)
+                records.append({
+                    "key": self.make_key(image_path),
+                    "item": Path(image_path).parent.name,
+                    "image": Path(image_path).name,
+                    "mtime_ns": stat.st_mtime_ns,
+                    "size": stat.st_size,
+                    "row": start_row + offset,
+                    "written_at": written_at,
+                })
+            with open(self._index_path(self.shard_id), "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(record) + "\n" for record in records))
+
+            for record in records:
+                record["shard"] = self.shard_id
+                self._entries[record["key"]] = record
+
+    def matrix(self) -> Tuple[List[str], np.ndarray]:
+        """Returns every stored key (sorted) and the matching embeddings as one (N, dim) float16 array."""
+        keys = sorted(self._entries)
+        matrix = np.empty((len(keys), self.dim), dtype=np.float16)
+
+        by_shard = {}
+        for position, key in enumerate(keys):
+            entry = self._entries[key]
+            by_shard.setdefault(entry["shard"], ([], []))
+            by_shard[entry["shard"]][0].append(position)
+            by_shard[entry["shard"]][1].append(entry["row"])
+
+        for shard, (positions, rows) in by_shard.items():
+            mmap = self._rows(shard, max(rows) + 1)
+            matrix[positions] = mmap[rows]
+        return keys, matrix
+
+
+def score_embeddings(
+    embeddings: np.ndarray,
+    text_features: np.ndarray,
+    prompt_to_category: List[str],
+    category_names: List[str],
+    chunk_size: int = 65536,
+) -> np.ndarray:
+    """
+    Scores normalized image embeddings against normalized text features on the CPU.
+
+    Mirrors the classifier: softmax over the 100x scaled prompt similarities, summed per category.
+    Returns an (N, categories) float32 array. Rows are processed in chunks only to bound the
+    float32 working set.
+    """
+    text_features = np.asarray(text_features, dtype=np.float32)
+    category_index = {name: i for i, name in enumerate(category_names)}
+    prompt_category_matrix = np.zeros((len(prompt_to_category), len(category_names)), dtype=np.float32)
+    prompt_category_matrix[np.arange(len(prompt_to_category)), [category_index[c] for c in prompt_to_category]] = 1.0
+
+    scores = np.empty((len(embeddings), len(category_names)), dtype=np.float32)
+    for start in range(0, len(embeddings), chunk_size):
+        chunk = np.asarray(embeddings[start:start + chunk_size], dtype=np.float32)
+        logits = 100.0 * chunk @ text_features.T
+        logits -= logits.max(axis=1, keepdims=True)
+        probabilities = np.exp(logits)
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        scores[start:start + chunk_size] = probabilities @ prompt_category_matrix
+
+    return scores
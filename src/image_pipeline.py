@@ -0,0 +1,99 @@
+import time
+import queue
+import logging
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, List, Optional, Tuple
+import torch
+from PIL import Image, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+
+class ImagePrefetcher:
+    """
+    Decodes and preprocesses images on a bounded thread pool ahead of the model.
+
+    A producer thread turns chunks of image paths into stacked (optionally pinned) tensors and puts
+    them on a queue holding at most `prefetch_batches` chunks, so the next chunks are being decoded
+    while the current one runs through the model. Time spent blocked on either side of the queue
+    is accumulated in `decode_wait_seconds` (queue full, model is the bottleneck) and
+    `model_wait_seconds` (queue empty, decoding is the bottleneck).
+    """
+
+    def __init__(self, preprocess: Callable, workers: int, prefetch_batches: int = 2, pin_memory: bool = False):
+        self.preprocess = preprocess
+        self.prefetch_batches = max(1, prefetch_batches)
+        self.pin_memory = pin_memory
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="image-decode")
+        self.decode_wait_seconds = 0.0
+        self.model_wait_seconds = 0.0
+
+    def _load(self, image_path: Path) -> Optional[torch.Tensor]:
+        """Opens and preprocesses one image; failures are logged and reported as None."""
+        try:
+            with Image.open(image_path) as image:
+                return self.preprocess(image.convert('RGB'))
+        except UnidentifiedImageError:
+            logger.error(f"Cannot identify image file (corrupted or wrong format): {image_path}")
+        except FileNotFoundError:
+            logger.error(f"Image file not found at path: {image_path}")
+        except Exception as e:
+            logger.exception(f"Unexpected error while loading image {image_path}: {e}")
+        return None
+
+    def _produce(self, image_paths: List[Path], chunk_size: int, out: queue.Queue, stop: threading.Event) -> None:
+        try:
+            for start in range(0, len(image_paths), chunk_size):
+                if stop.is_set():
+                    return
+                tensors = list(self.pool.map(self._load, image_paths[start:start + chunk_size]))
+                indices = [start + offset for offset, tensor in enumerate(tensors) if tensor is not None]
+                batch = torch.stack([tensors[i - start] for i in indices]) if indices else None
+                if batch is not None and self.pin_memory:
+                    batch = batch.pin_memory()
+
+                wait_start = time.perf_counter()
+                out.put((indices, batch))
+                self.decode_wait_seconds += time.perf_counter() - wait_start
+        except Exception as e:
+            out.put(e)
+        finally:
+            out.put(_DONE)
+
+    def batches(self, image_paths: List[Path], chunk_size: int) -> Iterator[Tuple[List[int], torch.Tensor]]:
+        """
+        Yields (indices, tensor) chunks for `image_paths` in order, where `indices` are the positions
+        of the successfully decoded images that make up the rows of `tensor`.
+        """
+        out = queue.Queue(maxsize=self.prefetch_batches)
+        stop = threading.Event()
+        producer = threading.Thread(target=self._produce, args=(list(image_paths), max(1, chunk_size), out, stop), daemon=True)
+        producer.start()
+        try:
+            while True:
+                wait_start = time.perf_counter()
+                item = out.get()
+                self.model_wait_seconds += time.perf_counter() - wait_start
+                if item is _DONE:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                indices, batch = item
+                if indices:
+                    yield indices, batch
+        finally:
+            # Unblock and finish the producer if the consumer stops early
+            stop.set()
+            while producer.is_alive():
+                try:
+                    out.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            producer.join()
+
+    def close(self) -> None:
+        self.pool.shutdown(wait=True)
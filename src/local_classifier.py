@@ -0,0 +1,194 @@
+import os
+import json
+import time
+import shutil
+import logging
+import argparse
+import multiprocessing
+from pathlib import Path
+from typing import List, Optional
+from concurrent.futures import ProcessPoolExecutor
+from classifier_core import CATEGORY_FOLDER_NAMES, ClassifierCore, log_job_summary
+
+try:
+    from dotenv import load_dotenv
+    load_dotenv()
+except ImportError:
+    pass
+
+
+_default_local_downloads = Path.home() / "Downloads" / "All_Downloads"
+LOCAL_DOWNLOADS_DIR = Path(os.environ.get("LOCAL_DOWNLOADS_DIR", str(_default_local_downloads)))
+
+LOCAL_OUTPUT_DIR = Path(os.environ.get("LOCAL_OUTPUT_DIR", "./Classified_Posts"))
+
+LOCAL_CACHE_DIR = Path(os.environ.get("LOCAL_CACHE_DIR", str(Path.home() / ".cache" / "clip-classifier")))
+
+LOCAL_WORKERS = int(os.environ.get("CLASSIFIER_LOCAL_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+
+TORCH_THREADS = int(os.environ.get("CLASSIFIER_TORCH_THREADS", str(max(1, (os.cpu_count() or 2) // LOCAL_WORKERS))))
+
+LOCAL_DECODE_WORKERS = int(os.environ.get("CLASSIFIER_LOCAL_DECODE_WORKERS", "2"))
+
+LOCAL_BATCH_SIZE = int(os.environ.get("CLASSIFIER_BATCH_SIZE", "32"))
+
+logger = logging.getLogger(__name__)
+
+
+class LocalClassifier(ClassifierCore):
+    """
+    Classifier backend for a machine without GPU, Modal or network access.
+
+    Routing mirrors the Drive layout on the local filesystem: every item is hard-linked (or
+    copied, across filesystems) into <output_dir>/<category folder>/<item>/. CLIP weights must
+    already be in the local CLIP download cache.
+    """
+
+    def __init__(self, downloads_dir: Path, output_dir: Path, cache_dir: Path):
+        self.downloads_dir = Path(downloads_dir).expanduser()
+        self.output_dir = Path(output_dir).expanduser()
+        self.category_folders = {key: str(self.output_dir / name) for key, name in CATEGORY_FOLDER_NAMES.items()}
+        self.load_model("cpu", Path(cache_dir).expanduser())
+
+    def _ensure_item_folder(self, item_dir_name: str, category_folder_id: str):
+        folder = Path(category_folder_id) / item_dir_name
+        try:
+            folder.mkdir(parents=True)
+            return (True, str(folder))
+        except FileExistsError:
+            return (False, str(folder))
+        except OSError as e:
+            self.logger.error(f"An error occurred creating folder '{folder}': {e}")
+            return None
+
+    def _upload_file(self, folder_id: str, file_path: Path) -> bool:
+        destination = Path(folder_id) / file_path.name
+        try:
+            try:
+                os.link(file_path, destination)
+            except OSError:
+                shutil.copy2(file_path, destination)
+            return True
+        except OSError as e:
+            self.logger.error(f"An error occurred while copying '{file_path.name}' to {destination}: {e}")
+            return False
+
+
+# The classifier loaded by the parent process. Forked workers inherit it, so the CLIP
+# weights are loaded once and their pages are shared instead of copied per worker.
+_classifier: Optional[LocalClassifier] = None
+
+
+def _init_worker(torch_threads: int, cache_dir: Path, decode_workers: int) -> None:
+    import torch
+
+    torch.set_num_threads(torch_threads)
+    # Threads and embedding store shards must not be shared across forks, so start them per worker
+    _classifier.start_pipeline(cache_dir, decode_workers)
+
+
+def _process_chunk(item_dir_names: List[str]) -> List[dict]:
+    return _classifier.process_items(item_dir_names)
+
+
+def run_local(
+    items_to_process: List[str],
+    downloads_dir: Path = LOCAL_DOWNLOADS_DIR,
+    output_dir: Path = LOCAL_OUTPUT_DIR,
+    cache_dir: Path = LOCAL_CACHE_DIR,
+    workers: int = LOCAL_WORKERS,
+    torch_threads: int = TORCH_THREADS,
+    batch_size: int = LOCAL_BATCH_SIZE,
+    decode_workers: int = LOCAL_DECODE_WORKERS,
+) -> List[dict]:
+    """
+    Classifies and routes item directories on a local process pool.
+
+    Items are split into batches of `batch_size`; each worker processes whole batches with
+    `torch_threads` intra-op threads. Returns one result dictionary per item, in input order,
+    in the same format as the Modal `process_item.map()` path (including 'framework_error'
+    entries for batches whose worker failed).
+    """
+    import torch
+
+    global _classifier
+    cache_dir = Path(cache_dir).expanduser()
+    # The parent only runs torch to encode the text prompts (on a cache miss). Keep it off torch's
+    # OpenMP thread pool: forking after that pool has started can hang the workers (GNU libgomp).
+    # Each worker sets its own thread count in _init_worker.
+    torch.set_num_threads(1)
+    _classifier = LocalClassifier(downloads_dir, output_dir, cache_dir)
+    _classifier.model.share_memory()
+
+    chunks = [items_to_process[i:i + batch_size] for i in range(0, len(items_to_process), batch_size)]
+    results = []
+    context = multiprocessing.get_context("fork")
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        initializer=_init_worker,
+        initargs=(torch_threads, cache_dir, decode_workers),
+    ) as pool:
+        futures = [pool.submit(_process_chunk, chunk) for chunk in chunks]
+        for chunk, future in zip(chunks, futures):
+            try:
+                chunk_results = future.result()
+            except Exception as e:
+                logger.error(f"An exception occurred in local worker processing: {e}")
+                chunk_results = [{"item": item, "status": "framework_error", "error": str(e)} for item in chunk]
+            for result in chunk_results:
+                logger.info(f"Processed '{result.get('item', 'N/A')}': Status={result.get('status', 'N/A')}, Category={result.get('category', 'N/A')}, Duration={result.get('duration_seconds', 'N/A')}s")
+            results.extend(chunk_results)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify downloaded posts on local CPU cores (no Modal, GPU or network).")
+    parser.add_argument("--downloads-dir", type=Path, default=LOCAL_DOWNLOADS_DIR, help="Directory containing one subdirectory per post.")
+    parser.add_argument("--output-dir", type=Path, default=LOCAL_OUTPUT_DIR, help="Where category folders with classified posts are created.")
+    parser.add_argument("--cache-dir", type=Path, default=LOCAL_CACHE_DIR, help="Text feature and image embedding cache.")
+    parser.add_argument("--workers", type=int, default=LOCAL_WORKERS, help="Number of worker processes.")
+    parser.add_argument("--torch-threads", type=int, default=TORCH_THREADS, help="Torch intra-op threads per worker.")
+    parser.add_argument("--batch-size", type=int, default=LOCAL_BATCH_SIZE, help="Items classified per forward pass.")
+    parser.add_argument("--decode-workers", type=int, default=LOCAL_DECODE_WORKERS, help="Image decode threads per worker.")
+    parser.add_argument("--results-file", type=Path, default=Path("local_classification_results.json"))
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+
+    downloads_dir = args.downloads_dir.expanduser()
+    if not downloads_dir.is_dir():
+        logger.error(f"Local downloads directory does not exist: {downloads_dir}.")
+        return
+    items_to_process = [d.name for d in downloads_dir.iterdir() if d.is_dir()]
+    if not items_to_process:
+        logger.warning(f"No subdirectories found in {downloads_dir}. Nothing to process.")
+        return
+
+    logger.info(f"Classifying {len(items_to_process)} items with {args.workers} workers x {args.torch_threads} torch threads...")
+    run_start_time = time.time()
+    results = run_local(
+        items_to_process,
+        downloads_dir=downloads_dir,
+        output_dir=args.output_dir,
+        cache_dir=args.cache_dir,
+        workers=args.workers,
+        torch_threads=args.torch_threads,
+        batch_size=args.batch_size,
+        decode_workers=args.decode_workers,
+    )
+    run_duration = time.time() - run_start_time
+
+    with open(args.results_file, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+
+    log_job_summary(results, len(items_to_process))
+    logger.info(f"Total job duration: {run_duration:.2f} seconds ({len(items_to_process) / run_duration:.2f} items/s).")
+
+
+if __name__ == "__main__":
+    main()
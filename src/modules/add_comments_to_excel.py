@@ -1,24 +1,55 @@
-from modules.count_comments import count_comments
-import pandas as pd
+import os
+from typing import List, Optional
+from modules.data_reader import read_workbook
+from modules.metadata_index import MetadataIndex
+from modules.reconcile import comment_counts, downloaded_posts, shortcode_expr
 
-def add_comments_to_excel(file_paths, download_dir):
+OUTPUT_FORMATS = ("xlsx", "parquet", "csv")
+
+
+def add_comments_to_excel(file_paths: List[str], download_dir: str, output: str = "xlsx", index: Optional[MetadataIndex] = None) -> List[str]:
     """
     Append comment counts to the existing Excel files based on metadata in .xz files.
 
+    Each workbook is read once and joined against the downloaded posts by the shortcode of its
+    permalinks; posts that were not downloaded get -1.
+
     Args:
         file_paths (List[str]): List of Excel file paths containing a 'Permalink' column.
         download_dir (str): Directory containing downloaded posts.
+        output (str): 'xlsx' rewrites the workbooks in place; 'parquet' or 'csv' leaves them untouched
+            and writes a '<workbook>_comments.parquet' / '.csv' sidecar next to each instead.
+        index (Optional[MetadataIndex]): Persistent metadata index to read the comment counts from.
+
+    Returns:
+        List[str]: The paths written.
     """
-    # Get comment counts in the format {url: comment_count}
-    comment_counts = count_comments(file_paths, download_dir)
-    
+    if output not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format '{output}', expected one of {OUTPUT_FORMATS}")
+
+    # Get the downloaded posts as a frame of (directory, shortcode, comment_count)
+    downloaded = downloaded_posts(download_dir, index)
 
+    written = []
     for file_path in file_paths:
-        # Load Excel into DataFrame
-        df = pd.read_excel(file_path)
+        # Load Excel into DataFrame (through its cached Parquet conversion)
+        df = read_workbook(file_path)
+
+        # Join 'Permalink' URLs to their comment counts; rows keep their order and count
+        df = df.drop("Comment Count", strict=False)
+        counts = comment_counts(df.select(shortcode_expr()), downloaded)["Comment Count"]
+        df = df.with_columns(counts)
 
-        # Map 'Permalink' URLs to their comment counts
-        df['Comment Count'] = df['Permalink'].map(comment_counts).fillna(-1)
+        # Save the updated DataFrame back to the file, or next to it
+        if output == "xlsx":
+            out_path = file_path
+            df.write_excel(out_path, autofit=False)
+        else:
+            out_path = f"{os.path.splitext(file_path)[0]}_comments.{output}"
+            if output == "parquet":
+                df.write_parquet(out_path)
+            else:
+                df.write_csv(out_path)
+        written.append(out_path)
 
-        # Save the updated DataFrame back to the file
-        df.to_excel(file_path, index=False)
+    return written
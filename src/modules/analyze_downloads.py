@@ -1,61 +1,63 @@
 from collections import defaultdict
 import os
-import json
-import lzma
 import shutil
 import logging
-from typing import Dict, List
-from modules.data_reader import get_column_data
+from typing import Dict, List, Optional
+from modules.dedup import find_redundant_folders
+from modules.metadata_index import MetadataIndex
+from modules.reconcile import downloaded_posts, excel_permalinks, failed_permalinks
+from modules.reformat import JOURNAL_NAME, REFORMAT_WORKERS, execute_reformat, load_journal, plan_reformat, uncovered_groups, write_plan_report
+from modules.metadata_reader import read_metadata_files
+from modules.scanner import iter_files, scan_tree
+
+def find_failed_urls(file_paths: List[str], download_dir: str, index: Optional[MetadataIndex] = None) -> List[str]:
+    """
+    Find and log failed(not downloaded) URLs that are in Excel files but missing from downloaded posts.
 
-def find_failed_urls(file_paths: List[str], download_dir: str) -> List[str]:
-    """Find and log failed(not downloaded) URLs that are in Excel files but missing from downloaded posts."""
+    Permalinks are matched to downloads by shortcode, so /reel/ and /tv/ links, query strings and
+    missing trailing slashes still match. With a MetadataIndex, shortcodes are read from the
+    (updated) index instead of every .xz file.
+    """
     
     # Get all URLs from the Excel files
-    urls_from_excel = set(get_column_data(file_paths))
-    logging.info(f"Number of unique urls: {len(urls_from_excel)}")
+    excel = excel_permalinks(file_paths).unique("Permalink", maintain_order=True)
+    logging.info(f"Number of unique urls: {excel.height}")
     
-
-    # Walk through download directory
-    for root, _, files in os.walk(os.path.expanduser(download_dir)):
-        if "Post" in root:
-            for file in files:
-                if file.endswith(".xz"):
-                    file_path = os.path.join(root, file)
-                    try:
-                        with lzma.open(file_path, "rt", encoding="utf-8") as f:
-                            data = json.load(f)
-                            shortcode = data.get("node", {}).get("shortcode")
-                            if shortcode:
-                                url = f"https://www.instagram.com/p/{shortcode}/"
-                                urls_from_excel.discard(url)  # remove if exists
-                    except (lzma.LZMAError, json.JSONDecodeError, OSError) as e:
-                        logging.error(f"Error processing {file_path}: {e}")
+    downloaded = downloaded_posts(download_dir, index, directory_filter=lambda root: "Post" in root)
+    failed_urls = failed_permalinks(excel, downloaded)["Permalink"]
 
     # Log the number of failed URLs
-    logging.info(f"Number of failed URLs: {len(urls_from_excel)}")
+    logging.info(f"Number of failed URLs: {len(failed_urls)}")
 
     # Write failed URLs to file
-    if urls_from_excel:
-        with open("failed_urls.txt", "w", encoding="utf-8") as file:
-            for url in urls_from_excel:
-                file.write(url + "\n")
+    if len(failed_urls):
+        failed_urls.to_frame().write_csv("failed_urls.txt", include_header=False, quote_style="never")
 
     # Log each failed URL and its index
-     # Log each failed URL and its index
-    for i, url in enumerate(urls_from_excel):
+    for i, url in enumerate(failed_urls):
         logging.info(f"Failed URL: {url} at index: {i}")
 
-    return list(urls_from_excel)
+    return failed_urls.to_list()
 
-def find_empty_folders(file_paths: List[str], download_dir: str) -> None:
-    """Find and log empty folders in the download directory."""
+def _post_folder_order(path: str):
+    """Sort key: numbered 'Post(...)-<n>' folders by number first, then the others (e.g. '-<shortcode>') by path."""
+    suffix = path.rsplit("-", 1)[-1]
+    return (0, int(suffix), path) if suffix.isdigit() else (1, 0, path)
+
+def find_empty_folders(file_paths: List[str], download_dir: str, index: Optional[MetadataIndex] = None) -> None:
+    """Find and log empty folders in the download directory (from the directory listings of `index`, if given)."""
    
     empty_dirs = []
-    for root, _, files in os.walk(os.path.expanduser(download_dir)): 
+    if index is not None:
+        index.update(download_dir)
+        listings = index.directories(download_dir)
+    else:
+        listings = scan_tree(download_dir)
+    for root, files in listings: 
         if "Post" in root and len(files) == 0:
             empty_dirs.append(root)
     
-    empty_dirs.sort(key=lambda x:int(x.split("-")[-1]))
+    empty_dirs.sort(key=_post_folder_order)
     
     for directory in empty_dirs:
         with open("empty_folders.txt", "a", encoding="utf-8") as file:
@@ -63,31 +65,29 @@ def find_empty_folders(file_paths: List[str], download_dir: str) -> None:
         logging.info(f"Empty folder: {directory}")
 
 
-def find_duplicate_downloads(download_dir: str) -> Dict[str, List[str]]:
+def find_duplicate_downloads(download_dir: str, index: Optional[MetadataIndex] = None) -> Dict[str, List[str]]:
     """
     Find and log duplicate downloads by looking for multiple files with the same Instagram URL.
     
     Args:
         download_dir: Directory containing downloaded posts
+        index: Optional metadata index to read shortcodes from instead of decompressing every .xz file
         
     Returns:
         Dictionary mapping duplicated URLs to list of file paths where they were found
     """
     url_bucket = defaultdict(list)
     
-    for root, _, files in os.walk(os.path.expanduser(download_dir)):
-        
-        for file in files:
-            if file.endswith(".xz"):
-                file_path = os.path.join(root, file)
-                try:
-                    with lzma.open(file_path, "rt", encoding="utf-8") as f:
-                        data = json.load(f)
-                        shortcode = data["node"]["shortcode"]
-                        url = f"https://www.instagram.com/p/{shortcode}/"
-                        url_bucket[url].append(root)
-                except (lzma.LZMAError, json.JSONDecodeError) as e:
-                    logging.error(f"Error processing {root}: {e}")
+    if index is not None:
+        index.update(download_dir)
+        for root, shortcode in index.shortcodes(download_dir):
+            url_bucket[f"https://www.instagram.com/p/{shortcode}/"].append(root)
+    else:
+        xz_files = [entry.path for entry in iter_files(download_dir, extensions=(".xz",))]
+        for file_path, fields, error in read_metadata_files(xz_files):
+            if error is None and fields[0]:
+                url = f"https://www.instagram.com/p/{fields[0]}/"
+                url_bucket[url].append(os.path.dirname(file_path))
     
 
     duplicates = {url: paths for url, paths in url_bucket.items() if len(paths) > 1}
@@ -99,8 +99,8 @@ def find_duplicate_downloads(download_dir: str) -> Dict[str, List[str]]:
             #print(f"{url} -> {paths}\n\n")
     return duplicates
 
-def remove_duplicates(download_dir: str) -> None: 
-    dups = find_duplicate_downloads(download_dir)
+def remove_duplicates(download_dir: str, index: Optional[MetadataIndex] = None) -> None: 
+    dups = find_duplicate_downloads(download_dir, index)
     
     for url, paths in dups.items(): 
         # Sort to ensure consistent behavior when deciding which to keep
@@ -115,53 +115,72 @@ def remove_duplicates(download_dir: str) -> None:
                     logging.error(f"Error removing folder {path}: {e}")
             else:
                 logging.warning(f"Path does not exist: {path}")
+
+def remove_content_duplicates(download_dir: str, perceptual: bool = False, remove_perceptual: bool = False, **kwargs) -> None:
+    """
+    Remove post folders whose media duplicates another post's, found by content hashes instead
+    of shortcodes. A folder is only removed when all of its media is in the folder that is kept
+    (see find_redundant_folders). Near-duplicate ('phash:') groups found with `perceptual` are only
+    reported unless `remove_perceptual` is set as well, in which case a near-duplicate image
+    counts as a copy. Keyword arguments go to find_redundant_folders.
+    """
+    redundant = find_redundant_folders(download_dir, perceptual=perceptual, match_perceptual=remove_perceptual, **kwargs)
+    for path, kept in sorted(redundant.items()):
+        if os.path.exists(path):
+            try:
+                shutil.rmtree(path)
+                logging.info(f"Removed duplicate folder: {path} (its media is in {kept})")
+            except OSError as e:
+                logging.error(f"Error removing folder {path}: {e}")
+        else:
+            logging.warning(f"Path does not exist: {path}")
     
-def reformat_download_structure(download_dir: str, destination_dir: str) -> None:
-    destination_root = os.path.expanduser(destination_dir)
-    suffix = 0
+def reformat_download_structure(download_dir: str, destination_dir: str, dry_run: bool = False, workers: int = REFORMAT_WORKERS, journal_path: Optional[str] = None) -> List[dict]:
+    """
+    Move every group of post files (same timestamp prefix, with at least a .jpg and a .txt) into its
+    own '<prefix>_<n>' folder under destination_dir.
 
-    for root, _, files in os.walk(os.path.expanduser(download_dir), topdown=False):
-        grouped = defaultdict(list)
+    Runs in two phases: the whole migration is planned first, then the groups are moved in
+    parallel, with os.rename when source and destination are on the same device. The plan and every
+    completed group are recorded in a journal, so an interrupted run resumes with the same plan
+    (and folder numbers) and skips the groups already moved. The journal is removed once the plan
+    is complete, so the next run plans again and picks up newly downloaded posts.
 
-        # Group files by timestamp prefix
-        for file in files:
-            if 'json' in file:
-                prefix = "_".join(os.path.splitext(os.path.splitext(file)[0])[0].split("_")[:4])
-                grouped[prefix].append(file)
-            else:
-                prefix = "_".join(os.path.splitext(file)[0].split("_")[:4])
-                grouped[prefix].append(file)
-            
-        for prefix, matched_files in grouped.items():
-            required_exts = {".jpg", ".txt"}
-            found_exts = {os.path.splitext(f)[1] for f in matched_files}
-
-            if found_exts >= required_exts:
-                # Create folder with unique suffix if needed
-                new_folder_path = os.path.join(destination_root, f"{prefix}_{suffix}")
-                suffix += 1  # Increment for next group
-
-                os.makedirs(new_folder_path, exist_ok=True)
-
-                for f in matched_files:
-                    src = os.path.join(root, f)
-                    dst = os.path.join(new_folder_path, f)
-
-                    if os.path.exists(dst):
-                        print(f"File {dst} already exists, skipping.")
-                    else:
-                        shutil.move(src, dst)
-
-                print(f"Moved {prefix} group to {new_folder_path}")
-                
-    print(f"Moved {suffix} files")
- 
-    for url, files in grouped.items():
-        if len(files) == 3:  # Check if all three required files are present
-            logging.info(f"URL {url} has all three required files.")
-            
-    total_with_all_three = sum(1 for file_count in grouped.values() if len(file_count) == 3)
-    logging.info(f"{total_with_all_three} groups have all three required files out of {len(grouped)}")
+    Args:
+        download_dir: Directory containing downloaded posts
+        destination_dir: Directory to create the group folders in
+        dry_run: Only plan, and write the plan to reformat_plan.txt without moving anything
+        workers: Groups moved concurrently
+        journal_path: Journal file, by default .reformat_journal.jsonl in destination_dir
+
+    Returns:
+        The plan, one dictionary per group
+    """
+    destination_root = os.path.expanduser(destination_dir)
+    journal_path = journal_path or os.path.join(destination_root, JOURNAL_NAME)
+
+    plan, done = load_journal(journal_path)
+    if plan is not None and done >= {group["id"] for group in plan}:
+        # A finished plan whose journal was not removed (e.g. interrupted right after the last group)
+        logging.info(f"The migration in {journal_path} is complete, planning again")
+        os.remove(journal_path)
+        plan, done = None, set()
+    if plan is None:
+        plan = plan_reformat(download_dir, destination_root)
+    else:
+        logging.info(f"Resuming migration from {journal_path}: {len(done)} of {len(plan)} groups already moved")
+        uncovered = uncovered_groups(plan, download_dir, destination_root)
+        if uncovered:
+            logging.warning(f"{len(uncovered)} groups in {download_dir} are not part of the resumed plan; "
+                            f"run reformat_download_structure again after this migration completes to move them")
+
+    if dry_run:
+        write_plan_report(plan)
+        return plan
+
+    os.makedirs(destination_root, exist_ok=True)
+    execute_reformat(plan, journal_path, done, workers)
+    return plan
     
 def get_img_types(download_dir: str) -> set:
     """
@@ -175,28 +194,34 @@ def get_img_types(download_dir: str) -> set:
     """
     img_types = set()
 
-    for root, _, files in os.walk(os.path.expanduser(download_dir), topdown=False):
-        for file in files:
-            _, ext = os.path.splitext(file)
-            if ext.lower() in {".jpg", ".jpeg", ".png", ".gif"}:  # Add more extensions if needed
-                img_types.add(ext.lower())
+    for entry in iter_files(download_dir, extensions=(".jpg", ".jpeg", ".png", ".gif")):  # Add more extensions if needed
+        img_types.add(os.path.splitext(entry.name)[1].lower())
 
     logging.info(f"Found image types: {img_types}")
     return img_types
 
     
-def get_caption_lengths(download_dir: str) -> None:
+def get_caption_lengths(download_dir: str, unit: str = "characters") -> None:
+    """
+    Report how many captions exceed the CLIP (77) and Long CLIP (248) context lengths.
+
+    Args:
+        download_dir: Directory containing downloaded posts
+        unit: 'characters' counts caption characters; 'tokens' tokenizes the captions with the CLIP
+              tokenizer in parallel and writes the full token-length histogram and percentiles
+              to caption_token_lengths.json (see modules.caption_stats).
+    """
+    if unit == "tokens":
+        from modules.caption_stats import caption_token_stats
+        caption_token_stats(download_dir)
+        return
     
     caption_lengths = defaultdict(int)
 
-    for root, _, files in os.walk(os.path.expanduser(download_dir), topdown=False):
-        for file in files:
-            _, ext = os.path.splitext(file)
-            if ext.lower() in {".txt"}:  
-                file_path = os.path.join(root, file)
-                with open(file_path, "r") as  f:
-                   text=  f.read().rstrip()
-                   caption_lengths[len(text)]+=1
+    for entry in iter_files(download_dir, extensions=(".txt",)):
+        with open(entry.path, "r") as  f:
+           text=  f.read().rstrip()
+           caption_lengths[len(text)]+=1
                     
     caption_lengths = sorted(caption_lengths.items(), key=lambda x: x[1])
     count_greater_than_248 = sum(freq   for len, freq in caption_lengths  if len >248)
@@ -0,0 +1,146 @@
+import os
+import json
+import logging
+import sqlite3
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from modules.scanner import iter_files
+
+CAPTION_TOKEN_CACHE_PATH = os.environ.get("CAPTION_TOKEN_CACHE_PATH", "caption_tokens.sqlite")
+
+CAPTION_TOKENIZE_WORKERS = int(os.environ.get("CAPTION_TOKENIZE_WORKERS", str(os.cpu_count() or 1)))
+
+CAPTION_TOKENIZE_BATCH_SIZE = int(os.environ.get("CAPTION_TOKENIZE_BATCH_SIZE", "256"))
+
+# Context lengths in tokens, including the start and end of text tokens
+CONTEXT_LENGTHS = {"CLIP": 77, "Long CLIP": 248}
+
+PERCENTILES = (50, 75, 90, 95, 99, 99.9, 100)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS caption_tokens (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    characters INTEGER NOT NULL,
+    tokens INTEGER NOT NULL
+);
+"""
+
+# CLIP's BPE tokenizer, loaded once per worker process
+_tokenizer = None
+
+
+def _load_tokenizer_class():
+    """
+    SimpleTokenizer of the CLIP package, loaded from clip/simple_tokenizer.py alone: importing it
+    as clip.simple_tokenizer would run clip/__init__.py, which imports torch. Needs ftfy and regex.
+    """
+    spec = importlib.util.find_spec("clip")
+    if spec is None or not spec.submodule_search_locations:
+        raise ImportError("The CLIP package is not installed: pip install ftfy regex git+https://github.com/openai/CLIP.git")
+    path = os.path.join(list(spec.submodule_search_locations)[0], "simple_tokenizer.py")
+    module_spec = importlib.util.spec_from_file_location("_clip_simple_tokenizer", path)
+    module = importlib.util.module_from_spec(module_spec)
+    module_spec.loader.exec_module(module)
+    return module.SimpleTokenizer
+
+
+def _tokenize_batch(file_paths: List[str]) -> List[Tuple[str, Optional[int], Optional[int], Optional[str]]]:
+    """(path, characters, tokens, error) per caption file; tokens include the start/end tokens."""
+    global _tokenizer
+    if _tokenizer is None:
+        _tokenizer = _load_tokenizer_class()()
+
+    results = []
+    for file_path in file_paths:
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                text = f.read().rstrip()
+            results.append((file_path, len(text), len(_tokenizer.encode(text)) + 2, None))
+        except (OSError, UnicodeDecodeError) as e:
+            results.append((file_path, None, None, str(e)))
+    return results
+
+
+def caption_token_lengths(
+    download_dir: str,
+    cache_path: str = CAPTION_TOKEN_CACHE_PATH,
+    workers: int = CAPTION_TOKENIZE_WORKERS,
+    batch_size: int = CAPTION_TOKENIZE_BATCH_SIZE,
+) -> Dict[str, Tuple[int, int]]:
+    """
+    CLIP token length of every caption (.txt) file below `download_dir`.
+
+    Captions are tokenized with the CLIP BPE tokenizer in batches on a process pool. Results are
+    cached per file (by path, mtime and size) in a SQLite database, so repeat runs only tokenize
+    new or changed captions.
+
+    Returns:
+        A dictionary mapping caption paths to (characters, tokens).
+    """
+    conn = sqlite3.connect(os.path.expanduser(cache_path))
+    try:
+        conn.executescript(_SCHEMA)
+        cached = {path: row for path, *row in conn.execute("SELECT path, mtime_ns, size, characters, tokens FROM caption_tokens")}
+
+        lengths = {}
+        stats = {}
+        for entry in iter_files(download_dir, extensions=(".txt",)):
+            try:
+                stat = entry.stat()
+            except OSError as e:
+                logging.error(f"Error processing {entry.path}: {e}")
+                continue
+            row = cached.get(entry.path)
+            if row and (row[0], row[1]) == (stat.st_mtime_ns, stat.st_size):
+                lengths[entry.path] = (row[2], row[3])
+            else:
+                stats[entry.path] = stat
+
+        pending = list(stats)
+        batches = [pending[i:i + max(1, batch_size)] for i in range(0, len(pending), max(1, batch_size))]
+        rows = []
+        if batches:
+            # Fail here, once, rather than in every worker process
+            _load_tokenizer_class()
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(batches) or 1))) as pool:
+            for future in as_completed([pool.submit(_tokenize_batch, batch) for batch in batches]):
+                for file_path, characters, tokens, error in future.result():
+                    if error is not None:
+                        logging.error(f"Error processing {file_path}: {error}")
+                        continue
+                    lengths[file_path] = (characters, tokens)
+                    rows.append((file_path, stats[file_path].st_mtime_ns, stats[file_path].st_size, characters, tokens))
+
+        with conn:
+            conn.executemany("INSERT OR REPLACE INTO caption_tokens VALUES (?, ?, ?, ?, ?)", rows)
+        logging.info(f"Tokenized {len(rows)} captions, {len(lengths) - len(rows)} from cache")
+        return lengths
+    finally:
+        conn.close()
+
+
+def caption_token_stats(download_dir: str, output_path: str = "caption_token_lengths.json", **kwargs) -> dict:
+    """
+    Writes the token-length histogram, percentiles and truncation counts of all captions to
+    `output_path` (JSON) and returns them. Keyword arguments go to caption_token_lengths.
+    """
+    tokens = np.fromiter((t for _, t in caption_token_lengths(download_dir, **kwargs).values()), dtype=np.int64)
+
+    lengths, counts = np.unique(tokens, return_counts=True)
+    stats = {
+        "captions": int(tokens.size),
+        "percentiles": {str(p): float(np.percentile(tokens, p)) for p in PERCENTILES} if tokens.size else {},
+        "exceeding": {name: int((tokens > limit).sum()) for name, limit in CONTEXT_LENGTHS.items()},
+        "histogram": {int(length): int(count) for length, count in zip(lengths, counts)},
+    }
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(stats, f, indent=2)
+
+    for name, limit in CONTEXT_LENGTHS.items():
+        logging.info(f"{stats['exceeding'][name]} of {stats['captions']} captions exceed {name} max {limit} context length (tokens)")
+    logging.info(f"Caption token length histogram and percentiles written to {output_path}")
+    return stats
@@ -1,23 +1,50 @@
 import os
-import lzma
-import json
 import logging
+from typing import Optional
+from modules.metadata_index import MetadataIndex
+from modules.metadata_reader import read_metadata_files
+from modules.scanner import scan_tree
 
 # Precondition: each directory has one .xz file and no duplicate shortcodes
-def rename_files(download_dir) -> None:
-    for root, _, files in os.walk(os.path.expanduser(download_dir), topdown=False):
-        for file in files:
-            if file.endswith(".xz"):
-                file_path = os.path.join(root, file)
-                try:
-                    with lzma.open(file_path, "rt", encoding="utf-8") as f:
-                        data = json.load(f)
-                        shortcode = data["node"]["shortcode"]
-                        new_dir_name = shortcode
-                        new_root = os.path.join(os.path.dirname(root), new_dir_name)
-                        if root != new_root:
-                            os.rename(root, new_root)
-                            logging.info(f"Renamed {root} → {new_root}")
-                except (lzma.LZMAError, json.JSONDecodeError, KeyError, OSError) as e:
-                    logging.error(f"Error processing {file_path}: {e}")
-                break  # only one .xz file per directory, so we stop after renaming
+def rename_files(download_dir, index: Optional[MetadataIndex] = None) -> None:
+    if index is not None:
+        _rename_files_from_index(download_dir, index)
+        return
+
+    # The first .xz file of every directory, in bottom-up order so renames never move a pending directory
+    first_xz_files = [entries[0].path for _, entries in scan_tree(download_dir, extensions=(".xz",), topdown=False) if entries]  # only one .xz file per directory
+
+    shortcodes = {file_path: fields[0] for file_path, fields, error in read_metadata_files(first_xz_files) if error is None}
+    for file_path in first_xz_files:
+        if file_path not in shortcodes:
+            continue # unreadable, already logged
+        root = os.path.dirname(file_path)
+        shortcode = shortcodes[file_path]
+        if not shortcode:
+            logging.error(f"Error processing {file_path}: no shortcode in metadata")
+            continue
+        new_root = os.path.join(os.path.dirname(root), shortcode)
+        if root != new_root:
+            try:
+                os.rename(root, new_root)
+                logging.info(f"Renamed {root} → {new_root}")
+            except OSError as e:
+                logging.error(f"Error processing {file_path}: {e}")
+
+def _rename_files_from_index(download_dir, index: MetadataIndex) -> None:
+    """rename_files using the shortcodes recorded in the metadata index, which is kept in sync with the renames."""
+    index.update(download_dir)
+    shortcodes = {}
+    for root, shortcode in index.shortcodes(download_dir):
+        shortcodes.setdefault(root, shortcode)  # only one .xz file per directory, so the first one wins
+
+    # Deepest directories first (like scan_tree(topdown=False)), so renames never move a pending directory
+    for root in sorted(shortcodes, key=lambda path: path.count(os.sep), reverse=True):
+        new_root = os.path.join(os.path.dirname(root), shortcodes[root])
+        if root != new_root:
+            try:
+                os.rename(root, new_root)
+                index.move_directory(root, new_root)
+                logging.info(f"Renamed {root} → {new_root}")
+            except OSError as e:
+                logging.error(f"Error processing {root}: {e}")
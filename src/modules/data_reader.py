@@ -1,17 +1,97 @@
-from typing import List
+import os
+import glob
+import logging
+import hashlib
+import threading
+from typing import List, Optional, Union
 import polars as pl
 from concurrent.futures import ThreadPoolExecutor
 
-def read_file(file_path: str) -> pl.DataFrame:
+# Parquet conversions of the Excel workbooks, reused until a workbook's size or mtime changes
+EXCEL_CACHE_DIR = os.environ.get("EXCEL_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "instagram-scrape", "excel"))
+
+
+def _cache_prefix(file_path: str, cache_dir: str) -> str:
+    """Cache file name prefix of a workbook: its stem plus a hash of its absolute path."""
+    path_hash = hashlib.sha1(os.path.abspath(file_path).encode("utf-8")).hexdigest()[:12]
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    return os.path.join(os.path.expanduser(cache_dir), f"{stem}-{path_hash}")
+
+
+def excel_to_parquet(file_path: str, cache_dir: str = EXCEL_CACHE_DIR) -> str:
+    """
+    Converts a workbook (first sheet, all columns) to Parquet once and returns the Parquet path.
+
+    The workbook's size and mtime are part of the cache file name, so a changed workbook is
+    converted again and its stale conversions are removed. Raises FileNotFoundError if the
+    workbook does not exist.
+    """
+    stat = os.stat(file_path)
+    prefix = _cache_prefix(file_path, cache_dir)
+    cache_path = f"{prefix}-{stat.st_size}-{stat.st_mtime_ns}.parquet"
+    if os.path.exists(cache_path):
+        return cache_path
+
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    df = pl.read_excel(file_path)
+    # Write to a temporary file first so concurrent readers never see a partial conversion
+    tmp_path = f"{cache_path}.{os.getpid()}-{threading.get_ident()}.tmp"
+    df.write_parquet(tmp_path)
+    os.replace(tmp_path, cache_path)
+    logging.info(f"Converted {file_path} to {cache_path}")
+
+    for stale_path in glob.glob(f"{glob.escape(prefix)}-*.parquet"):
+        if stale_path != cache_path:
+            try:
+                os.remove(stale_path)
+            except OSError:
+                pass
+    return cache_path
+
+
+def read_workbook(file_path: str, columns: Optional[List[str]] = None, use_cache: bool = True) -> pl.DataFrame:
+    """
+    Reads the first sheet of a workbook, projecting `columns` (None for all columns).
+
+    With `use_cache`, the workbook is read through its Parquet conversion; if it cannot be
+    converted (e.g. a column's type cannot be inferred), it is read directly instead.
+    """
+    if use_cache:
+        try:
+            return pl.read_parquet(excel_to_parquet(file_path), columns=columns)
+        except FileNotFoundError:
+            raise
+        except Exception as e:
+            logging.warning(f"Could not use a Parquet conversion of {file_path}, reading it directly: {e}")
+    return pl.read_excel(file_path, columns=columns)
+
+
+def read_file(file_path: str, columns: Optional[List[str]] = None, use_cache: bool = True) -> pl.DataFrame:
     try:
-        return pl.read_excel(file_path, columns=["Permalink"])
+        return read_workbook(file_path, columns or ["Permalink"], use_cache)
     except FileNotFoundError:
         return pl.DataFrame()
 
-def get_column_data(file_paths: List[str]) -> List[str]:
+
+def read_columns(file_paths: List[str], columns: List[str], use_cache: bool = True) -> pl.DataFrame:
+    """Reads `columns` of every existing workbook (in parallel) into one DataFrame."""
     with ThreadPoolExecutor() as executor:
-        dataframes = [df for df in executor.map(read_file, file_paths) if not df.is_empty()]
-    
-    return pl.concat(dataframes)["Permalink"].to_list() if dataframes else []
+        dataframes = [df for df in executor.map(lambda file_path: read_file(file_path, columns, use_cache), file_paths) if not df.is_empty()]
+
+    return pl.concat(dataframes, how="vertical_relaxed") if dataframes else pl.DataFrame()
+
 
+def get_column_data(file_paths: List[str], column: str = "Permalink", as_series: bool = False, use_cache: bool = True) -> Union[List[str], pl.Series]:
+    """
+    Values of one column across all workbooks.
 
+    Args:
+        file_paths: Workbooks to read; missing ones are skipped.
+        column: Column to read.
+        as_series: Return the polars Series (Arrow-backed, no per-value Python objects) instead of a list.
+        use_cache: Read through the Parquet conversion cache.
+    """
+    df = read_columns(file_paths, [column], use_cache)
+    if df.is_empty():
+        return pl.Series(column, [], dtype=pl.String) if as_series else []
+    return df[column] if as_series else df[column].to_list()
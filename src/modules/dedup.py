@@ -0,0 +1,304 @@
+import os
+import mmap
+import hashlib
+import logging
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+from modules.scanner import iter_files
+
+DEDUP_WORKERS = int(os.environ.get("DEDUP_WORKERS", str(os.cpu_count() or 1)))
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+# Largest Hamming distance between 64-bit perceptual hashes that still counts as a near-duplicate
+PERCEPTUAL_MAX_DISTANCE = int(os.environ.get("DEDUP_PERCEPTUAL_MAX_DISTANCE", "4"))
+
+# Perceptual hashes with fewer set (or unset) bits than this come from flat, low-detail images
+# (a solid color hashes to 0) and would match unrelated images; they are not compared
+PERCEPTUAL_MIN_BITS = int(os.environ.get("DEDUP_PERCEPTUAL_MIN_BITS", "8"))
+
+
+def content_hash(file_path: str) -> Optional[str]:
+    """BLAKE2b digest of a file read through a memory map, or None if it cannot be read."""
+    try:
+        with open(file_path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return hashlib.blake2b(b"").hexdigest()
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return hashlib.blake2b(mapped).hexdigest()
+    except (OSError, ValueError) as e:
+        logging.error(f"Error hashing {file_path}: {e}")
+        return None
+
+
+def perceptual_hash(file_path: str) -> Optional[int]:
+    """64-bit difference hash (dHash) of an image, or None if it cannot be decoded."""
+    from PIL import Image
+
+    try:
+        with Image.open(file_path) as image:
+            image.draft("L", (64, 64)) # let JPEG decode at a reduced size
+            pixels = list(image.convert("L").resize((9, 8), Image.BILINEAR).getdata())
+    except Exception as e:
+        logging.error(f"Error computing perceptual hash of {file_path}: {e}")
+        return None
+
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return bits
+
+
+def _perceptual_hashes(file_paths: List[str]) -> List[Tuple[str, Optional[int]]]:
+    return [(file_path, perceptual_hash(file_path)) for file_path in file_paths]
+
+
+class HammingIndex:
+    """
+    Finds 64-bit hashes within `max_distance` bits of each other without comparing all pairs.
+
+    Each hash is split into max_distance + 1 bands; two hashes within max_distance bits must agree
+    exactly on at least one band (pigeonhole), so only hashes sharing a band bucket are compared.
+    """
+
+    def __init__(self, max_distance: int):
+        self.max_distance = max_distance
+        self.bands = max_distance + 1
+        self.band_bits = 64 // self.bands
+        self._buckets = defaultdict(list)
+        self._hashes = []
+
+    def _keys(self, value: int) -> Iterable[Tuple[int, int]]:
+        mask = (1 << self.band_bits) - 1
+        for band in range(self.bands):
+            # The last band takes the remaining bits
+            if band == self.bands - 1:
+                yield band, value >> (band * self.band_bits)
+            else:
+                yield band, (value >> (band * self.band_bits)) & mask
+
+    def add(self, value: int) -> int:
+        """Adds a hash and returns its position."""
+        position = len(self._hashes)
+        self._hashes.append(value)
+        for key in self._keys(value):
+            self._buckets[key].append(position)
+        return position
+
+    def query(self, value: int) -> List[int]:
+        """Positions of the added hashes within max_distance of `value`."""
+        matches = set()
+        for key in self._keys(value):
+            for position in self._buckets[key]:
+                if position not in matches and bin(self._hashes[position] ^ value).count("1") <= self.max_distance:
+                    matches.add(position)
+        return sorted(matches)
+
+
+def is_degenerate(value: int, min_bits: int = PERCEPTUAL_MIN_BITS) -> bool:
+    """True for perceptual hashes of (nearly) featureless images, see PERCEPTUAL_MIN_BITS."""
+    bits = bin(value).count("1")
+    return bits < min_bits or bits > 64 - min_bits
+
+
+def _near_duplicate_groups(hashed: List[Tuple[str, int]], max_distance: int) -> List[Tuple[int, List[str]]]:
+    """
+    Groups images around a representative: every member is within max_distance of the group's
+    representative itself, so matches are never chained (A~B and B~C does not put A and C together).
+    Returns (representative hash, member paths) for groups of at least two images.
+    """
+    index = HammingIndex(max_distance)
+    for _, value in hashed:
+        index.add(value)
+
+    assigned = set()
+    groups = []
+    for position, (path, value) in enumerate(hashed):
+        if position in assigned:
+            continue
+        members = [match for match in index.query(value) if match not in assigned]
+        assigned.update(members)
+        if len(members) > 1:
+            groups.append((value, [hashed[match][0] for match in members]))
+    return groups
+
+
+def _content_groups(
+    download_dir: str,
+    extensions: Iterable[str],
+    perceptual: bool,
+    max_distance: int,
+    workers: int,
+) -> Tuple[Dict[str, List[str]], Dict[str, List[str]]]:
+    """
+    Groups of files sharing a content key ('sha:<digest>' or 'phash:<hash>'), and the media files
+    of every post folder (media directly in download_dir belongs to no post folder and is left out).
+    """
+    # The scanner expands '~', so the root is compared in the same form
+    root = os.path.normpath(os.path.expanduser(download_dir))
+    by_size = defaultdict(list)
+    folder_media = defaultdict(list)
+    for entry in iter_files(download_dir, extensions=extensions):
+        try:
+            by_size[entry.stat().st_size].append(entry.path)
+        except OSError as e:
+            logging.error(f"Error processing {entry.path}: {e}")
+            continue
+        if os.path.normpath(os.path.dirname(entry.path)) != root:
+            folder_media[os.path.dirname(entry.path)].append(entry.path)
+    candidates = [path for paths in by_size.values() if len(paths) > 1 for path in paths]
+    logging.info(f"Hashing {len(candidates)} files that share their size with another file")
+
+    by_hash = defaultdict(list)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        for file_path, digest in zip(candidates, pool.map(content_hash, candidates)):
+            if digest is not None:
+                by_hash[f"sha:{digest}"].append(file_path)
+    groups = {key: paths for key, paths in by_hash.items() if len(paths) > 1}
+
+    if perceptual:
+        # Every file is compared, not only same-size ones: near-duplicates differ in size
+        sha_group = {path: key for key, paths in groups.items() for path in paths}
+        exact = {path for paths in groups.values() for path in paths[1:]}
+        images = [path for paths in by_size.values() for path in paths if path not in exact]
+        chunks = [images[i:i + 64] for i in range(0, len(images), 64)]
+        hashed = []
+        with ProcessPoolExecutor(max_workers=max(1, min(workers, len(chunks) or 1))) as pool:
+            for results in pool.map(_perceptual_hashes, chunks):
+                hashed.extend((path, value) for path, value in results if value is not None)
+
+        hashed.sort()
+        degenerate = [path for path, value in hashed if is_degenerate(value)]
+        if degenerate:
+            logging.info(f"Skipping {len(degenerate)} low-detail images in the perceptual comparison")
+        hashed = [(path, value) for path, value in hashed if not is_degenerate(value)]
+
+        for value, group in _near_duplicate_groups(hashed, max_distance):
+            # Include the exact duplicates of the group's files; the 'sha:' groups stay as they are
+            members = set(group)
+            for key in {sha_group[path] for path in group if path in sha_group}:
+                members.update(groups[key])
+            groups[f"phash:{value:016x}"] = sorted(members)
+    return groups, dict(folder_media)
+
+
+def _duplicate_folders(groups: Dict[str, List[str]], folder_media: Dict[str, List[str]]) -> Dict[str, List[str]]:
+    """Post folders per content key; copies within one folder are not duplicate posts."""
+    duplicates = {}
+    for key, paths in groups.items():
+        folders = sorted({os.path.dirname(path) for path in paths} & folder_media.keys())
+        if len(folders) > 1:
+            duplicates[key] = folders
+    logging.info(f"Number of duplicate media groups: {len(duplicates)}")
+    return duplicates
+
+
+def _write_report(duplicates: Dict[str, List[str]], report_path: str) -> None:
+    with open(report_path, "w", encoding="utf-8") as f:
+        for key, folders in duplicates.items():
+            f.write(f"{key} -> {folders}\n------------------------\n")
+
+
+def find_content_duplicates(
+    download_dir: str,
+    extensions: Iterable[str] = IMAGE_EXTENSIONS,
+    perceptual: bool = False,
+    max_distance: int = PERCEPTUAL_MAX_DISTANCE,
+    workers: int = DEDUP_WORKERS,
+    report_path: str = "content_duplicates.txt",
+) -> Dict[str, List[str]]:
+    """
+    Find post folders holding the same media under different shortcodes.
+
+    Files are bucketed by size and only files sharing a size are hashed (in parallel, through
+    memory maps). With `perceptual`, one representative per distinct content is also given a
+    perceptual hash (in parallel processes) and near-identical images (re-encoded or resized
+    reposts) are grouped around a representative through a Hamming-distance index; images too
+    flat to hash meaningfully are left out.
+
+    Args:
+        download_dir: Directory containing downloaded posts
+        extensions: Media file extensions to compare
+        perceptual: Also group near-duplicate images
+        max_distance: Largest Hamming distance between perceptual hashes of near-duplicates
+        workers: Hashing threads / perceptual hashing processes
+        report_path: Duplicate report file
+
+    Returns:
+        Dictionary mapping a duplicate key ('sha:<digest>' or 'phash:<hash>') to the sorted list of
+        post folders that share it, like find_duplicate_downloads
+    """
+    groups, folder_media = _content_groups(download_dir, extensions, perceptual, max_distance, workers)
+    duplicates = _duplicate_folders(groups, folder_media)
+    _write_report(duplicates, report_path)
+    return duplicates
+
+
+def find_redundant_folders(
+    download_dir: str,
+    extensions: Iterable[str] = IMAGE_EXTENSIONS,
+    perceptual: bool = False,
+    match_perceptual: bool = False,
+    max_distance: int = PERCEPTUAL_MAX_DISTANCE,
+    workers: int = DEDUP_WORKERS,
+    report_path: str = "content_duplicates.txt",
+) -> Dict[str, str]:
+    """
+    Find post folders whose whole media set is also in another post folder, which is kept.
+
+    Sharing one image does not make two posts the same: a folder is only redundant when every
+    one of its media files has a copy in the kept folder. The folder kept is the one with the
+    most media among those that hold all of it (the first in sorted order among equals, so the
+    first of a set of identical posts is kept), and a folder kept for another one is never
+    removed itself. Folders that only partly overlap another are logged and left alone.
+    The duplicate groups are written to `report_path` as by find_content_duplicates.
+
+    Args:
+        download_dir: Directory containing downloaded posts
+        extensions: Media file extensions to compare
+        perceptual: Also group (and report) near-duplicate images
+        match_perceptual: Count a near-duplicate image as a copy, not only an identical file
+        max_distance: Largest Hamming distance between perceptual hashes of near-duplicates
+        workers: Hashing threads / perceptual hashing processes
+        report_path: Duplicate report file
+
+    Returns:
+        Dictionary mapping every redundant post folder to the folder holding its media
+    """
+    groups, folder_media = _content_groups(download_dir, extensions, perceptual or match_perceptual, max_distance, workers)
+    _write_report(_duplicate_folders(groups, folder_media), report_path)
+
+    prefixes = ("sha:", "phash:") if match_perceptual else ("sha:",)
+    # Post folders holding a copy of each file, the file's own folder included
+    holders = defaultdict(set)
+    for key, paths in groups.items():
+        if key.startswith(prefixes):
+            folders = {os.path.dirname(path) for path in paths} & folder_media.keys()
+            for path in paths:
+                holders[path] |= folders
+
+    def preference(folder):
+        return -len(folder_media[folder]), folder
+
+    redundant = {}
+    kept = set()
+    # Least preferred first, so every folder is checked against all folders it could be kept for
+    for folder in sorted(folder_media, key=preference, reverse=True):
+        if folder in kept:
+            continue
+        covering = None
+        for path in folder_media[folder]:
+            others = holders.get(path, set()) - {folder}
+            covering = others if covering is None else covering & others
+            if not covering:
+                break
+        covering = sorted((covering or set()) - redundant.keys(), key=preference)
+        if covering:
+            redundant[folder] = covering[0]
+            kept.add(covering[0])
+        elif any(holders.get(path, set()) - {folder} for path in folder_media[folder]):
+            logging.info(f"Keeping {folder}: it shares media with other posts but no other post has all of it")
+    logging.info(f"Number of redundant post folders: {len(redundant)}")
+    return redundant
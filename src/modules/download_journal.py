@@ -0,0 +1,69 @@
+import os
+import json
+import logging
+import threading
+from typing import Dict, Optional
+
+DOWNLOAD_JOURNAL_PATH = os.environ.get("DOWNLOAD_JOURNAL_PATH", "download_journal.jsonl")
+
+
+class DownloadJournal:
+    """
+    Persistent record of downloaded posts: one JSON line {'shortcode', 'target'} per completed
+    download, appended and fsync'd right after it finishes. A line is written with a single
+    append, so an interruption can at most tear the last line, which is ignored on load.
+    """
+
+    def __init__(self, path: str = DOWNLOAD_JOURNAL_PATH):
+        self.path = os.path.expanduser(path)
+        self._lock = threading.Lock()
+        self._completed = self._load()
+        self._file = open(self.path, "a", encoding="utf-8")
+        if self._file.tell() and not self._ends_with_newline():
+            self._file.write("\n") # start after a torn last line instead of extending it
+
+    def _ends_with_newline(self) -> bool:
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) == b"\n"
+
+    def _load(self) -> Dict[str, str]:
+        completed = {}
+        if not os.path.exists(self.path):
+            return completed
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue # torn last line of an interrupted run
+                completed[record["shortcode"]] = record["target"]
+        logging.info(f"Loaded {len(completed)} completed downloads from {self.path}")
+        return completed
+
+    def __contains__(self, shortcode: str) -> bool:
+        return shortcode in self._completed
+
+    def __len__(self) -> int:
+        return len(self._completed)
+
+    def target(self, shortcode: str) -> Optional[str]:
+        """Target directory a shortcode was downloaded to, or None if it was not downloaded."""
+        return self._completed.get(shortcode)
+
+    def record(self, shortcode: str, target: str) -> None:
+        """Records a completed download; safe to call from several threads."""
+        with self._lock:
+            self._file.write(json.dumps({"shortcode": shortcode, "target": target}) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._completed[shortcode] = target
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
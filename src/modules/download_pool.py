@@ -0,0 +1,278 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import Counter, deque
+from concurrent.futures import Future, wait
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from modules.download_journal import DownloadJournal
+from modules.download_profiles import ArtifactStats
+
+# Attempts per post before a rate-limited post is given up on (it is handed to another worker in between)
+DOWNLOAD_MAX_ATTEMPTS = int(os.environ.get("DOWNLOAD_MAX_ATTEMPTS", "3"))
+
+
+class PostNotFoundError(Exception):
+    """The post does not exist (anymore); it is not retried."""
+
+
+class RateLimitedError(Exception):
+    """The session was rate limited (429) or redirected to the login page (302); the post is retried."""
+
+
+class DownloadBackend:
+    """
+    One download session (e.g. one logged-in account). Backends raise PostNotFoundError and
+    RateLimitedError for those outcomes; any other exception counts as a failed download.
+    """
+
+    name = "backend"
+    # AdaptiveRateController (or None) pacing this session; backed off when the backend is rate limited
+    rate_controller = None
+    # ArtifactStats (or None) counting the files this session wrote per artifact type
+    artifacts = None
+
+    def login(self) -> None:
+        """Prepares the session; called once, before any download, from the pool's thread."""
+
+    def download(self, shortcode: str, target: str) -> Optional[List[Future]]:
+        """
+        Downloads one post into the `target` directory. Returns the futures of media files still
+        being fetched (see MediaFetcher), if any; the post is complete once they are done.
+        """
+        raise NotImplementedError
+
+
+class LocalFakeBackend(DownloadBackend):
+    """
+    Backend without network access for exercising the pool: a download writes a caption file
+    to '<target>/<shortcode>.txt' after `latency` seconds. Shortcodes in `not_found` raise
+    PostNotFoundError; those in `rate_limited` raise RateLimitedError the first time they are tried.
+    With a `fetcher` and a `media_url` format string (e.g. 'http://127.0.0.1:8000/{shortcode}.jpg'
+    of a local HTTP stand-in), the post's media file is fetched through the fetcher as well.
+    """
+
+    def __init__(self, name: str = "fake", latency: float = 0.0, not_found: Iterable[str] = (), rate_limited: Iterable[str] = (), rate_controller=None, fetcher=None, media_url: Optional[str] = None):
+        self.name = name
+        self.latency = latency
+        self.not_found = set(not_found)
+        self.rate_limited = set(rate_limited)
+        self.rate_controller = rate_controller
+        self.fetcher = fetcher
+        self.media_url = media_url
+        self.artifacts = ArtifactStats()
+        self.downloads = []
+
+    def download(self, shortcode: str, target: str) -> Optional[List[Future]]:
+        if self.rate_controller is not None:
+            self.rate_controller.wait_before_query("fake")
+        if shortcode in self.not_found:
+            raise PostNotFoundError(f"Post {shortcode} not found")
+        if shortcode in self.rate_limited:
+            self.rate_limited.discard(shortcode)
+            raise RateLimitedError(f"429 for {shortcode}")
+        time.sleep(self.latency)
+        os.makedirs(target, exist_ok=True)
+        with open(os.path.join(target, f"{shortcode}.txt"), "w", encoding="utf-8") as f:
+            f.write(shortcode)
+        self.artifacts.add(os.path.join(target, f"{shortcode}.txt"))
+        self.downloads.append(shortcode)
+        if self.fetcher is not None and self.media_url:
+            media = self.fetcher.fetch(self.media_url.format(shortcode=shortcode), os.path.join(target, shortcode))
+            media.add_done_callback(lambda future: future.exception() is None and self.artifacts.add(future.result()))
+            return [media]
+        return None
+
+
+class DownloadPool:
+    """
+    Spreads posts over several backends, one worker thread each. Workers take posts from a
+    shared queue and claim their shortcode first, so a post is downloaded at most once even
+    if it is listed several times. Completed posts are recorded in the journal.
+
+    A worker stops once the queue is empty and no other worker is downloading a post (which
+    could still be handed back). A rate-limited post is left to the other workers, unless the
+    worker that released it is the only one left.
+    """
+
+    def __init__(self, backends: List[DownloadBackend], journal: DownloadJournal, target_prefix: str = "Post(F_6)", max_attempts: int = DOWNLOAD_MAX_ATTEMPTS):
+        self.backends = backends
+        self.journal = journal
+        self.target_prefix = target_prefix
+        self.max_attempts = max(1, max_attempts)
+        # (url, shortcode, attempt, name of the backend that released it after a rate limit)
+        self._queue = deque()
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._in_flight = 0
+        self._alive = 0
+        self._claimed: Set[str] = set()
+        self._posts: Dict[str, dict] = {}
+        self._workers: Dict[str, Counter] = {}
+        # One future per post whose media files are still being fetched
+        self._fetching: List[Future] = []
+
+    def _claim(self, shortcode: str) -> bool:
+        with self._lock:
+            if shortcode in self._claimed or shortcode in self.journal:
+                return False
+            self._claimed.add(shortcode)
+            return True
+
+    def _result(self, backend: DownloadBackend, url: str, shortcode: str, status: str, target: Optional[str] = None, error: Optional[str] = None) -> None:
+        with self._lock:
+            self._workers[backend.name][status] += 1
+            self._posts[shortcode] = {"url": url, "status": status, "worker": backend.name, "target": target, "error": error}
+
+    def _take(self, backend: DownloadBackend) -> Optional[tuple]:
+        """
+        Next post for `backend`, waiting while only posts it released itself are queued (and other
+        workers are alive) or while other workers still have posts in flight. None once all are done.
+        """
+        with self._changed:
+            while True:
+                for item in self._queue:
+                    if item[3] != backend.name or self._alive == 1:
+                        self._queue.remove(item)
+                        self._in_flight += 1
+                        return item
+                if not self._queue and not self._in_flight:
+                    return None
+                self._changed.wait()
+
+    def _work(self, backend: DownloadBackend) -> None:
+        try:
+            while True:
+                item = self._take(backend)
+                if item is None:
+                    return
+                try:
+                    self._download(backend, *item[:3])
+                finally:
+                    with self._changed:
+                        self._in_flight -= 1
+                        self._changed.notify_all()
+        finally:
+            # Posts this worker released can now go back to the last worker left
+            with self._changed:
+                self._alive -= 1
+                self._changed.notify_all()
+
+    def _download(self, backend: DownloadBackend, url: str, shortcode: str, attempt: int) -> None:
+        if not self._claim(shortcode):
+            logging.debug(f"Post {shortcode} is already claimed or downloaded, skipping.")
+            return
+
+        target = f"{self.target_prefix}-{shortcode}"
+        backoffs = backend.rate_controller.backoffs if backend.rate_controller is not None else 0
+        try:
+            media = backend.download(shortcode, target)
+        except PostNotFoundError as e:
+            logging.error(f"Post not found for URL {url}: {e}")
+            self._result(backend, url, shortcode, "not_found", error=str(e))
+        except RateLimitedError as e:
+            logging.error(f"{backend.name}: rate limit hit while processing URL {url}: {e}")
+            # Instaloader reports every 429 it retries to the controller (handle_429); only back
+            # off here if the backend did not, so one episode is not counted twice
+            if backend.rate_controller is not None and backend.rate_controller.backoffs == backoffs:
+                backend.rate_controller.backoff(str(e))
+            if attempt + 1 < self.max_attempts:
+                # Release the claim and hand the post back to the other workers
+                with self._changed:
+                    self._claimed.discard(shortcode)
+                    self._workers[backend.name]["rate_limited"] += 1
+                    self._queue.append((url, shortcode, attempt + 1, backend.name))
+                    self._changed.notify_all()
+            else:
+                self._result(backend, url, shortcode, "failed", error=str(e))
+        except Exception as e:
+            logging.error(f"{backend.name}: exception type: {type(e).__name__} - Failed to download post at URL {url}: {e}")
+            self._result(backend, url, shortcode, "failed", error=str(e))
+        else:
+            if media:
+                # The worker moves on to the next post's metadata while the media is fetched
+                self._complete_when_fetched(backend, url, shortcode, target, media)
+            else:
+                self._completed(backend, url, shortcode, target)
+
+    def _completed(self, backend: DownloadBackend, url: str, shortcode: str, target: str) -> None:
+        self.journal.record(shortcode, target)
+        self._result(backend, url, shortcode, "downloaded", target=target)
+        logging.info(f"{backend.name}: downloaded post {shortcode} ({self.journal.path} has {len(self.journal)} posts).")
+
+    def _complete_when_fetched(self, backend: DownloadBackend, url: str, shortcode: str, target: str, media: List[Future]) -> None:
+        """Records the post as downloaded (or failed) once all of its media futures are done."""
+        post_done = Future()
+        remaining = [len(media)]
+
+        def on_done(_):
+            with self._lock:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            errors = [f.exception() for f in media if f.exception() is not None]
+            try:
+                if errors:
+                    logging.error(f"{backend.name}: failed to fetch media of post at URL {url}: {errors[0]}")
+                    self._result(backend, url, shortcode, "failed", error=str(errors[0]))
+                else:
+                    self._completed(backend, url, shortcode, target)
+            finally:
+                post_done.set_result(None)
+
+        with self._lock:
+            self._fetching.append(post_done)
+        for future in media:
+            future.add_done_callback(on_done)
+
+    def run(self, posts: List[Tuple[str, str]], report_path: str = "download_report.json") -> dict:
+        """
+        Downloads (url, shortcode) pairs with all backends that log in successfully.
+
+        Returns:
+            The merged report, also written to `report_path` (JSON): totals per status, per-worker
+            counts with their rate controller stats, and the outcome of every post.
+        """
+        for url, shortcode in posts:
+            self._queue.append((url, shortcode, 0, None))
+
+        workers = []
+        for backend in self.backends:
+            try:
+                backend.login()
+            except Exception as e:
+                logging.error(f"Login of {backend.name} failed, it will not download: {e}")
+                continue
+            self._workers[backend.name] = Counter()
+            workers.append(threading.Thread(target=self._work, args=(backend,), name=f"download-{backend.name}"))
+        if not workers:
+            logging.error("No download session could log in.")
+
+        logging.info(f"Starting download of {len(posts)} posts with {len(workers)} sessions.")
+        self._alive = len(workers)
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        wait(self._fetching)
+
+        report = {
+            "totals": dict(Counter(post["status"] for post in self._posts.values())),
+            "workers": {
+                backend.name: {
+                    **self._workers[backend.name],
+                    "rate_controller": backend.rate_controller.stats() if backend.rate_controller is not None else None,
+                    "artifacts": backend.artifacts.as_dict() if backend.artifacts is not None else None,
+                }
+                for backend in self.backends if backend.name in self._workers
+            },
+            "artifacts": ArtifactStats.merge(backend.artifacts.as_dict() for backend in self.backends if backend.artifacts is not None),
+            "posts": self._posts,
+        }
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        for kind, counts in report["artifacts"].items():
+            logging.info(f"{kind}: {counts['files']} files, {counts['bytes'] / 1e6:.1f} MB")
+        logging.info(f"Download totals: {report['totals']}. Report written to {report_path}")
+        return report
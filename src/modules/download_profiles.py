@@ -0,0 +1,118 @@
+import os
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, Optional
+
+# Instaloader options of each profile; every option not set here keeps Instaloader's default
+DOWNLOAD_PROFILES = {
+    # Smallest download the classifier can work with: only the first image of a carousel (or a
+    # video's thumbnail), the caption and the metadata. CLASSIFIER_POST_REDUCTION then sees one image.
+    "classify-minimal": {
+        "download_pictures": True,
+        "download_videos": False,
+        "download_video_thumbnails": True,
+        "download_geotags": False,
+        "download_comments": False,
+        "save_metadata": True,
+        "compress_json": True,
+        "slide": "1",
+    },
+    # What the classifier uses: every image of a carousel (reduced with CLASSIFIER_POST_REDUCTION)
+    # or a video's thumbnail, the caption and the metadata; no videos
+    "classify": {
+        "download_pictures": True,
+        "download_videos": False,
+        "download_video_thumbnails": True,
+        "download_geotags": False,
+        "download_comments": False,
+        "save_metadata": True,
+        "compress_json": True,
+    },
+    # Everything Instaloader can store for a post
+    "full-archive": {
+        "download_pictures": True,
+        "download_videos": True,
+        "download_video_thumbnails": True,
+        "download_geotags": True,
+        "download_comments": True,
+        "save_metadata": True,
+        "compress_json": True,
+    },
+}
+
+DOWNLOAD_PROFILE = os.environ.get("DOWNLOAD_PROFILE", "classify")
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".heic")
+
+VIDEO_EXTENSIONS = (".mp4",)
+
+
+def profile_options(profile: str = DOWNLOAD_PROFILE) -> dict:
+    """Instaloader options of a download profile; raises ValueError for an unknown profile."""
+    if profile not in DOWNLOAD_PROFILES:
+        raise ValueError(f"Unknown download profile '{profile}', expected one of {sorted(DOWNLOAD_PROFILES)}.")
+    return dict(DOWNLOAD_PROFILES[profile])
+
+
+def artifact_type(file_path: str) -> str:
+    """Artifact type of a file Instaloader writes: image, video, caption, metadata, comments, geotag or other."""
+    name = os.path.basename(file_path).lower()
+    if name.endswith("_comments.json"):
+        return "comments"
+    if name.endswith("_location.txt"):
+        return "geotag"
+    if name.endswith((".json", ".json.xz")):
+        return "metadata"
+    if name.endswith(".txt"):
+        return "caption"
+    if name.endswith(IMAGE_EXTENSIONS):
+        return "image"
+    if name.endswith(VIDEO_EXTENSIONS):
+        return "video"
+    return "other"
+
+
+def snapshot(directory: str) -> Dict[str, tuple]:
+    """(size, mtime_ns) of every file in a directory (not recursive); empty if it does not exist."""
+    try:
+        with os.scandir(directory) as entries:
+            return {entry.path: (entry.stat().st_size, entry.stat().st_mtime_ns) for entry in entries if entry.is_file()}
+    except FileNotFoundError:
+        return {}
+
+
+class ArtifactStats:
+    """Thread-safe count of files written and bytes per artifact type."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = defaultdict(lambda: {"files": 0, "bytes": 0})
+
+    def add(self, file_path: str, size: Optional[int] = None) -> None:
+        if size is None:
+            size = os.path.getsize(file_path)
+        with self._lock:
+            stats = self._stats[artifact_type(file_path)]
+            stats["files"] += 1
+            stats["bytes"] += size
+
+    def add_changes(self, before: Dict[str, tuple], after: Dict[str, tuple], skip: Iterable[str] = ()) -> None:
+        """Counts the files that are new or changed between two snapshots, except artifact types in `skip`."""
+        for path, (size, mtime_ns) in after.items():
+            if path.endswith(".temp") or artifact_type(path) in skip or before.get(path) == (size, mtime_ns):
+                continue
+            self.add(path, size)
+
+    def as_dict(self) -> Dict[str, dict]:
+        with self._lock:
+            return {kind: dict(stats) for kind, stats in sorted(self._stats.items())}
+
+    @staticmethod
+    def merge(stats: Iterable[Dict[str, dict]]) -> Dict[str, dict]:
+        """Sums several as_dict() results."""
+        merged = defaultdict(lambda: {"files": 0, "bytes": 0})
+        for per_type in stats:
+            for kind, counts in per_type.items():
+                merged[kind]["files"] += counts["files"]
+                merged[kind]["bytes"] += counts["bytes"]
+        return {kind: dict(counts) for kind, counts in sorted(merged.items())}
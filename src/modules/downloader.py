@@ -1,75 +1,168 @@
-import time
-import random
+import os
 import logging
-from typing import List
+from concurrent.futures import Future
+from contextlib import nullcontext
+from datetime import datetime
+from typing import List, Optional
 import instaloader
-from modules.rate_controller import MyRateController
-
-def batch_post_downloads(urls: List[str]):
-
-    loader = instaloader.Instaloader(
-        sanitize_paths=True,
-        fatal_status_codes=[302, 400],
-        rate_controller=lambda ctx: MyRateController(ctx)
-    )
-    
-    try: 
-        loader.interactive_login("some_username")
-    except (instaloader.exceptions.BadCredentialsException, instaloader.exceptions.InvalidArgumentException) as e:
-        logging.error("Login failed. Please check your username and password or ensure your account is not locked. Error: {}".format(e))
-        return
-    
-  
-    total_posts = len(urls)
-    logging.info("Starting download of {} posts.".format(total_posts))
-    
-    succedded_count = 0
-    
-    # Iterate through each URL and download the corresponding post.
-    for i in range(total_posts):
-        post_url = urls[i].strip()  # Ensure no leading/trailing whitespace
+from modules.download_journal import DOWNLOAD_JOURNAL_PATH, DownloadJournal
+from modules.download_pool import DownloadBackend, DownloadPool, PostNotFoundError, RateLimitedError
+from modules.download_profiles import DOWNLOAD_PROFILE, ArtifactStats, profile_options, snapshot
+from modules.media_fetcher import MEDIA_FETCH_CONCURRENCY, MediaFetcher, url_extension
+from modules.rate_controller import AdaptiveRateController
+
+# Accounts downloading in parallel, one session each (comma separated)
+DOWNLOAD_USERNAMES = [u.strip() for u in os.environ.get("DOWNLOAD_USERNAMES", "some_username").split(",") if u.strip()]
+
+def parse_shortcode(post_url: str) -> Optional[str]:
+    """Shortcode of a post URL (its last path segment), or None if the URL is invalid."""
+    post_url = post_url.strip()  # Ensure no leading/trailing whitespace
+    # Remove any trailing slash and extract shortcode
+    clean_url = post_url.rstrip('/')
+    parts = clean_url.split('/')
+    if not post_url or len(parts) < 2:
+        return None
+    return parts[-1] if parts[-1] else parts[-2]
+
+class PipelinedInstaloader(instaloader.Instaloader):
+    """
+    Instaloader that hands picture and video downloads to a MediaFetcher instead of fetching them
+    on its own session; metadata queries stay on the (rate-controlled) session. The futures of the
+    files handed off since the last take_pending() call are collected in `pending`.
+    """
+
+    def __init__(self, fetcher: MediaFetcher, **kwargs):
+        super().__init__(**kwargs)
+        self.fetcher = fetcher
+        self.pending: List[Future] = []
+
+    def download_pic(self, filename: str, url: str, mtime: datetime, filename_suffix: Optional[str] = None, _attempt: int = 1) -> bool:
+        if filename_suffix is not None:
+            filename += '_' + filename_suffix
+        nominal_filename = filename + '.' + url_extension(url)
+        if os.path.isfile(nominal_filename):
+            self.context.log(nominal_filename + ' exists', end=' ', flush=True)
+            return False
+        self.pending.append(self.fetcher.fetch(url, filename, mtime.timestamp()))
+        return True
+
+    def take_pending(self) -> List[Future]:
+        pending, self.pending = self.pending, []
+        return pending
+
+class InstaloaderBackend(DownloadBackend):
+    """
+    One logged-in Instaloader session with its own adaptive rate controller. The download
+    profile selects which artifacts are fetched; the files written are counted per artifact
+    type in `artifacts`. With a `fetcher`, the media files of a post are fetched in the
+    background while the session moves on.
+    """
+
+    def __init__(self, username: str, rate_controller: Optional[AdaptiveRateController] = None, fetcher: Optional[MediaFetcher] = None, profile: str = DOWNLOAD_PROFILE):
+        self.name = username
+        # Paces every query; reported 429s and 302s cut its rate, successful queries raise it
+        self.rate_controller = rate_controller or AdaptiveRateController(name=username)
+        self.artifacts = ArtifactStats()
+        options = dict(
+            sanitize_paths=True,
+            fatal_status_codes=[302, 400],
+            rate_controller=self.rate_controller.attach,
+            **profile_options(profile)
+        )
+        self.loader = PipelinedInstaloader(fetcher, **options) if fetcher is not None else instaloader.Instaloader(**options)
+
+    def login(self) -> None:
         try:
-            # Remove any trailing slash and extract shortcode
-            clean_url = post_url.rstrip('/')
-            parts = clean_url.split('/')
-            if not post_url or len(parts) < 2:
-                logging.info(f"URL invalid {post_url}")
-                continue
-
-            post_shortcode = parts[-1] if parts[-1] else parts[-2]
-
-            post = instaloader.Post.from_shortcode(loader.context, post_shortcode)
-            
-            #check if target directory exists 
+            # Reuse a session saved by a previous login (instaloader -l <username>)
+            self.loader.load_session_from_file(self.name)
+        except FileNotFoundError:
+            try: 
+                self.loader.interactive_login(self.name)
+            except (instaloader.exceptions.BadCredentialsException, instaloader.exceptions.InvalidArgumentException) as e:
+                logging.error("Login failed. Please check your username and password or ensure your account is not locked. Error: {}".format(e))
+                raise
+
+    def download(self, shortcode: str, target: str) -> Optional[List[Future]]:
+        pipelined = isinstance(self.loader, PipelinedInstaloader)
+        if pipelined:
+            self.loader.take_pending() # drop hand-offs of a post that failed half-way
+        before = snapshot(target)
+        try:
+            post = instaloader.Post.from_shortcode(self.loader.context, shortcode)
             #instaloader already handles checking for exisiting posts and will skip downloading if it already exists. no need to double check here.
-            post_dir = f"Post(F_6)-{succedded_count}"
-            
-            loader.download_post(post, target=post_dir)
-            succedded_count += 1
-            delay = random.uniform(3, 6)
-            logging.info(f"Downloaded post {i+1}/{total_posts}. Waiting {delay:.2f} seconds before next request.")
-            time.sleep(delay)
-
-            # Additional rate limiting every 1000 posts
-            if (i+1) % 1000 == 0:
-                long_delay = random.uniform(180, 300)
-                logging.info(f"Reached {i+1} posts. Taking a longer break for {long_delay:.2f} seconds.")
-                time.sleep(long_delay)
+            self.loader.download_post(post, target=target)
+            if not pipelined:
+                return None
+            media = self.loader.take_pending()
+            for future in media:
+                future.add_done_callback(self._count_fetched)
+            return media
         except instaloader.exceptions.QueryReturnedNotFoundException as e:
-            logging.error(f"Post not found for URL {post_url}: {e}")
-            continue
+            raise PostNotFoundError(str(e)) from e
         except instaloader.exceptions.TooManyRequestsException as e:
-            logging.error(f"Rate limit hit while processing URL {post_url}: {e}")
-            time.sleep(random.uniform(300, 600))
-            continue
-        except Exception as e:
-            logging.error(f"Exception type: {type(e).__name__} - Failed to download post at URL {post_url}: {e}")
-            
-                
-    
+            raise RateLimitedError(f"429: {e}") from e
+        except instaloader.exceptions.AbortDownloadException as e:
+            # Raised for the fatal status codes, e.g. a 302 redirect to the login page
+            raise RateLimitedError(f"302/400: {e}") from e
+        except instaloader.exceptions.ConnectionException as e:
+            # get_json retries 429s itself and, after its last attempt, raises a ConnectionException from the 429
+            if isinstance(e.__cause__, instaloader.exceptions.TooManyRequestsException):
+                raise RateLimitedError(f"429: {e}") from e
+            raise
+        finally:
+            # Fetched media is counted when its fetch completes
+            self.artifacts.add_changes(before, snapshot(target), skip=("image", "video") if pipelined else ())
+
+    def _count_fetched(self, future: Future) -> None:
+        if future.exception() is None:
+            self.artifacts.add(future.result())
+
+def batch_post_downloads(urls: List[str], journal_path: str = DOWNLOAD_JOURNAL_PATH, target_prefix: str = "Post(F_6)", usernames: Optional[List[str]] = None, backends: Optional[List[DownloadBackend]] = None, profile: str = DOWNLOAD_PROFILE) -> Optional[dict]:
+    """
+    Download the posts of a list of URLs, one target directory per post.
+
+    Completed downloads are recorded in a journal, so a rerun (e.g. after a ban) skips them
+    without any request. Target directories are named after the shortcode, so they stay the
+    same across runs whatever the order or failures. Posts are spread over one session per
+    account, each paced by its own rate controller.
+
+    Args:
+        urls: Post URLs
+        journal_path: Journal of completed shortcodes and their target directories
+        target_prefix: Target directories are named '<target_prefix>-<shortcode>'
+        usernames: Accounts to download with, one session each (default: DOWNLOAD_USERNAMES)
+        backends: Download sessions to use instead of Instaloader sessions (e.g. LocalFakeBackend)
+        profile: Download profile selecting the artifacts to fetch (see DOWNLOAD_PROFILES)
+
+    Returns:
+        The merged download report (see DownloadPool.run), or None if nothing was left to download
+    """
+    with DownloadJournal(journal_path) as journal:
+        pending = []
+        for post_url in urls:
+            post_shortcode = parse_shortcode(post_url)
+            if post_shortcode is None:
+                logging.info(f"URL invalid {post_url.strip()}")
+            elif post_shortcode in journal:
+                logging.debug(f"Post {post_shortcode} already downloaded to {journal.target(post_shortcode)}, skipping.")
+            else:
+                pending.append((post_url.strip(), post_shortcode))
+        skipped_count = len(urls) - len(pending)
+        logging.info(f"Skipping {skipped_count} of {len(urls)} URLs (already downloaded or invalid).")
+        if not pending:
+            return None
+
+        # Media files of all sessions share one pooled HTTP client
+        with (MediaFetcher() if backends is None and MEDIA_FETCH_CONCURRENCY > 0 else nullcontext()) as fetcher:
+            if backends is None:
+                backends = [InstaloaderBackend(username, fetcher=fetcher, profile=profile) for username in usernames or DOWNLOAD_USERNAMES]
+                logging.info(f"Downloading with profile '{profile}'.")
+            report = DownloadPool(backends, journal, target_prefix).run(pending)
+
+    succedded_count = report["totals"].get("downloaded", 0)
     if succedded_count == 0:
         logging.warning("No posts were processed. Check the input URLs.")
-        return
-    failed_count = total_posts - succedded_count
-    logging.info(f"Completed downloading {succedded_count} posts with {failed_count} failures. Check 'failed_urls.txt' for details.")
-
+        return report
+    failed_count = len(pending) - succedded_count
+    logging.info(f"Completed downloading {succedded_count} posts with {failed_count} failures. {len(journal)} posts are recorded in {journal.path}.")
+    return report
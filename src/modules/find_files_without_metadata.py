@@ -1,29 +1,31 @@
 import os
-import json
-import lzma
-from typing import List
+from typing import List, Optional
+from modules.metadata_index import MetadataIndex
+from modules.metadata_reader import read_metadata_files
+from modules.scanner import scan_tree
 
 
-def find_files_without_metadata(download_dir: str) -> List[str]:
-    """Find directories that don't have .xz metadata files."""
+def find_files_without_metadata(download_dir: str, index: Optional[MetadataIndex] = None) -> List[str]:
+    """
+    Find directories that don't have .xz metadata files.
+    With a MetadataIndex, validity of the metadata files is read from the (updated) index.
+    """
     dirs_without_metadata = []
+
+    if index is not None:
+        index.update(download_dir)
+        with_metadata = index.directories_with_metadata(download_dir)
+        return [root for root, _ in index.directories(download_dir) if root not in with_metadata]
     
-    for root, _, files in os.walk(os.path.expanduser(download_dir)):
-        has_metadata = False
-        for file in files:
-            if file.endswith(".xz"):
-                try:
-                    file_path = os.path.join(root, file)
-                    with lzma.open(file_path, "rt", encoding="utf-8") as f:
-                        json.load(f)  # Verify it's a valid JSON file
-                        has_metadata = True
-                        break
-                except (lzma.LZMAError, json.JSONDecodeError) as e:
-                    print(f"Error reading metadata from {file_path}: {e}")
-                    continue
-        
-        if not has_metadata:
-            dirs_without_metadata.append(root)
+    all_dirs = []
+    xz_files = []
+    for root, entries in scan_tree(download_dir, extensions=(".xz",)):
+        all_dirs.append(root)
+        xz_files.extend(entry.path for entry in entries)
+
+    # A directory has metadata if any of its .xz files is valid JSON; no fields are needed for that
+    with_metadata = {os.path.dirname(file_path) for file_path, _, error in read_metadata_files(xz_files, fields=()) if error is None}
+    dirs_without_metadata = [root for root in all_dirs if root not in with_metadata]
     
     return dirs_without_metadata
 
@@ -0,0 +1,124 @@
+import os
+import re
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from functools import partial
+from typing import Optional
+import aiohttp
+
+# Media files downloaded at the same time; 0 downloads media on the Instaloader session instead
+MEDIA_FETCH_CONCURRENCY = int(os.environ.get("MEDIA_FETCH_CONCURRENCY", "16"))
+
+MEDIA_FETCH_ATTEMPTS = int(os.environ.get("MEDIA_FETCH_ATTEMPTS", "3"))
+
+MEDIA_FETCH_CHUNK_SIZE = 1 << 16
+
+# Retrying these cannot help (e.g. an expired URL signature)
+_FATAL_STATUS_CODES = {403, 404}
+
+
+def url_extension(url: str) -> str:
+    """File extension of a media URL, the way Instaloader derives it."""
+    urlmatch = re.search('\\.[a-z0-9]*\\?', url)
+    return url[-3:] if urlmatch is None else urlmatch.group(0)[1:-1]
+
+
+class MediaFetcher:
+    """
+    Downloads media files (CDN image and video URLs) on a pooled aiohttp session running on a
+    background event loop, so they overlap each other and the caller's next metadata request.
+
+    At most `concurrency` files are downloaded at once; each is streamed to '<path>.temp' in
+    chunks and renamed into place when complete. fetch() can be called from any thread and
+    returns a concurrent.futures.Future of the written path.
+    """
+
+    def __init__(self, concurrency: int = MEDIA_FETCH_CONCURRENCY, attempts: int = MEDIA_FETCH_ATTEMPTS, timeout: float = 300):
+        self.concurrency = max(1, concurrency)
+        self.attempts = max(1, attempts)
+        self.timeout = timeout
+        self.files = 0
+        self.bytes = 0
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="media-fetcher", daemon=True)
+        self._thread.start()
+        self._session, self._semaphore = asyncio.run_coroutine_threadsafe(self._open(), self._loop).result()
+
+    async def _open(self):
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return session, asyncio.Semaphore(self.concurrency)
+
+    def fetch(self, url: str, filename: str, mtime: Optional[float] = None) -> Future:
+        """
+        Downloads `url` to `filename` plus the extension of its Content-Type (or of the URL) and
+        sets the file's mtime to `mtime`. A file that already exists is not downloaded again.
+        """
+        return asyncio.run_coroutine_threadsafe(self._fetch(url, filename, mtime), self._loop)
+
+    async def _fetch(self, url: str, filename: str, mtime: Optional[float]) -> str:
+        async with self._semaphore:
+            for attempt in range(1, self.attempts + 1):
+                try:
+                    return await self._fetch_once(url, filename, mtime)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    status = getattr(e, "status", None)
+                    if status in _FATAL_STATUS_CODES or attempt == self.attempts:
+                        logging.error(f"Error downloading {url} to {filename}: {e}")
+                        raise
+                    logging.warning(f"Error downloading {url} (attempt {attempt}/{self.attempts}), retrying: {e}")
+                    await asyncio.sleep(2 ** attempt)
+
+    async def _fetch_once(self, url: str, filename: str, mtime: Optional[float]) -> str:
+        # Disk I/O runs on the loop's default executor, so a slow write never stalls other transfers
+        loop = asyncio.get_running_loop()
+        # Like Instaloader, look for the file under the URL's extension before requesting it
+        path = f"{filename}.{url_extension(url)}"
+        if await loop.run_in_executor(None, os.path.isfile, path):
+            return path
+
+        async with self._session.get(url, raise_for_status=True) as resp:
+            content_type = resp.headers.get("Content-Type", "")
+            if content_type:
+                extension = content_type.split(';')[0].split('/')[-1].lower().replace('jpeg', 'jpg')
+                path = f"{filename}.{extension}"
+                if await loop.run_in_executor(None, os.path.isfile, path):
+                    return path
+
+            await loop.run_in_executor(None, partial(os.makedirs, os.path.dirname(path) or ".", exist_ok=True))
+            size = 0
+            # Stream to a temporary file so an interrupted download never leaves a partial file behind
+            f = await loop.run_in_executor(None, open, f"{path}.temp", "wb")
+            try:
+                async for chunk in resp.content.iter_chunked(MEDIA_FETCH_CHUNK_SIZE):
+                    await loop.run_in_executor(None, f.write, chunk)
+                    size += len(chunk)
+            finally:
+                await loop.run_in_executor(None, f.close)
+            await loop.run_in_executor(None, os.replace, f"{path}.temp", path)
+        if mtime is not None:
+            await loop.run_in_executor(None, os.utime, path, (mtime, mtime))
+        self.files += 1
+        self.bytes += size
+        return path
+
+    def close(self) -> None:
+        """Waits for the files in flight, then closes the session and stops the event loop."""
+        async def _close():
+            pending = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            await asyncio.gather(*pending, return_exceptions=True)
+            await self._session.close()
+
+        asyncio.run_coroutine_threadsafe(_close(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        logging.info(f"Fetched {self.files} media files ({self.bytes} bytes)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
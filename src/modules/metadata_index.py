@@ -0,0 +1,155 @@
+import os
+import json
+import sqlite3
+import logging
+from typing import Dict, Iterator, List, Optional, Tuple
+from modules.metadata_reader import read_metadata_files
+from modules.scanner import scan_tree
+
+METADATA_INDEX_PATH = os.environ.get("METADATA_INDEX_PATH", "metadata_index.sqlite")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata_files (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    shortcode TEXT,
+    comment_count INTEGER,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS metadata_files_directory ON metadata_files (directory);
+CREATE INDEX IF NOT EXISTS metadata_files_shortcode ON metadata_files (shortcode);
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    files TEXT NOT NULL
+);
+"""
+
+
+def _prefix_range(root: str) -> Tuple[str, str]:
+    """Bounds (inclusive, exclusive) of every path strictly below `root`, for range queries."""
+    prefix = os.path.join(root, "")
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class MetadataIndex:
+    """
+    Persistent SQLite index of the downloads tree.
+
+    For every .xz metadata file it records the directory, shortcode, comment count, mtime and size
+    (or the error that made it unreadable), and for every directory its file list. `update` only
+    decompresses files that are new or whose mtime or size changed since the last run, so repeat
+    analyses over a large, mostly unchanged tree avoid a full decompression pass.
+    """
+
+    def __init__(self, db_path: str = METADATA_INDEX_PATH):
+        self.db_path = os.path.expanduser(db_path)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def update(self, download_dir: str) -> Dict[str, int]:
+        """
+        Brings the index up to date with the tree under `download_dir`.
+
+        Returns:
+            Counts of 'parsed', 'unchanged' and 'removed' metadata files.
+        """
+        root = os.path.abspath(os.path.expanduser(download_dir))
+        low, high = _prefix_range(root)
+        known = {
+            path: (mtime_ns, size)
+            for path, mtime_ns, size in self.conn.execute(
+                "SELECT path, mtime_ns, size FROM metadata_files WHERE path >= ? AND path < ?", (low, high)
+            )
+        }
+
+        directories = []
+        changed = {} # file path -> (directory, stat)
+        seen = set()
+        for dir_path, entries in scan_tree(root):
+            directories.append((dir_path, json.dumps(sorted(entry.name for entry in entries))))
+            for entry in entries:
+                if not entry.name.endswith(".xz"):
+                    continue
+                file_path = entry.path
+                try:
+                    stat = entry.stat()
+                except OSError as e:
+                    logging.error(f"Error processing {file_path}: {e}")
+                    continue
+                seen.add(file_path)
+                if known.get(file_path) != (stat.st_mtime_ns, stat.st_size):
+                    changed[file_path] = (dir_path, stat)
+
+        rows = []
+        for file_path, fields, error in read_metadata_files(list(changed)):
+            dir_path, stat = changed[file_path]
+            shortcode, comment_count = fields or (None, None)
+            rows.append((file_path, dir_path, shortcode, comment_count, stat.st_mtime_ns, stat.st_size, error))
+
+        removed = [(path,) for path in known if path not in seen]
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO metadata_files VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            self.conn.executemany("DELETE FROM metadata_files WHERE path = ?", removed)
+            self.conn.execute("DELETE FROM directories WHERE path = ? OR (path >= ? AND path < ?)", (root, low, high))
+            self.conn.executemany("INSERT INTO directories VALUES (?, ?)", directories)
+
+        stats = {"parsed": len(rows), "unchanged": len(seen) - len(rows), "removed": len(removed)}
+        logging.info(f"Metadata index {self.db_path}: parsed {stats['parsed']}, unchanged {stats['unchanged']}, removed {stats['removed']} .xz files under {root}")
+        return stats
+
+    def _under(self, download_dir: str, columns: str, where: str = "") -> Iterator[tuple]:
+        root = os.path.abspath(os.path.expanduser(download_dir))
+        low, high = _prefix_range(root)
+        query = f"SELECT {columns} FROM metadata_files WHERE path >= ? AND path < ?"
+        if where:
+            query += f" AND {where}"
+        return self.conn.execute(query + " ORDER BY path", (low, high))
+
+    def shortcodes(self, download_dir: str) -> Iterator[Tuple[str, str]]:
+        """Yields (directory, shortcode) for every readable metadata file that has a shortcode."""
+        return self._under(download_dir, "directory, shortcode", "shortcode IS NOT NULL")
+
+    def posts(self, download_dir: str) -> Iterator[Tuple[str, str, Optional[int]]]:
+        """Yields (directory, shortcode, comment count) for every metadata file that has a shortcode."""
+        return self._under(download_dir, "directory, shortcode, comment_count", "shortcode IS NOT NULL")
+
+    def comment_counts(self, download_dir: str) -> Iterator[Tuple[str, int]]:
+        """Yields (shortcode, comment count) for every metadata file that has both."""
+        return self._under(download_dir, "shortcode, comment_count", "shortcode IS NOT NULL AND comment_count IS NOT NULL")
+
+    def directories(self, download_dir: str) -> Iterator[Tuple[str, List[str]]]:
+        """Yields (directory, file names) for `download_dir` and every directory below it."""
+        root = os.path.abspath(os.path.expanduser(download_dir))
+        low, high = _prefix_range(root)
+        for path, files in self.conn.execute(
+            "SELECT path, files FROM directories WHERE path = ? OR (path >= ? AND path < ?) ORDER BY path", (root, low, high)
+        ):
+            yield path, json.loads(files)
+
+    def directories_with_metadata(self, download_dir: str) -> set:
+        """Directories holding at least one readable metadata file."""
+        return {directory for (directory,) in self._under(download_dir, "DISTINCT directory", "error IS NULL")}
+
+    def move_directory(self, old_path: str, new_path: str) -> None:
+        """Re-keys a renamed directory (and everything below it) without re-parsing its files."""
+        old_path, new_path = os.path.abspath(old_path), os.path.abspath(new_path)
+        low, high = _prefix_range(old_path)
+        with self.conn:
+            for table, columns in (("metadata_files", ("path", "directory")), ("directories", ("path",))):
+                for column in columns:
+                    self.conn.execute(
+                        f"UPDATE {table} SET {column} = ? || substr({column}, ?) WHERE {column} = ? OR ({column} >= ? AND {column} < ?)",
+                        (new_path, len(old_path) + 1, old_path, low, high),
+                    )
@@ -0,0 +1,123 @@
+import os
+import json
+import lzma
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Iterator, List, Optional, Sequence, Tuple
+
+METADATA_READ_WORKERS = int(os.environ.get("METADATA_READ_WORKERS", str(os.cpu_count() or 1)))
+
+METADATA_READ_CHUNK_SIZE = int(os.environ.get("METADATA_READ_CHUNK_SIZE", "32"))
+
+try:
+    import orjson
+    _loads = orjson.loads
+    JSON_BACKEND = "orjson"
+except ImportError:
+    _loads = json.loads
+    JSON_BACKEND = "json"
+
+# Field paths into an instaloader post document; integer segments index into lists
+SHORTCODE = "node.shortcode"
+
+COMMENT_COUNT = "node.edge_media_to_parent_comment.count"
+
+# Errors that make a metadata file unreadable; anything else is a bug and propagates
+READ_ERRORS = (lzma.LZMAError, EOFError, ValueError, UnicodeDecodeError, OSError)
+
+
+def _split(fields: Sequence[str]) -> List[Tuple[str, ...]]:
+    return [tuple(field.split(".")) if field else () for field in fields]
+
+
+def _project(data: Any, path: Tuple[str, ...]) -> Any:
+    """Value at a split field path, or None if any step is missing."""
+    for step in path:
+        if isinstance(data, dict):
+            data = data.get(step)
+        elif isinstance(data, list) and step.lstrip("-").isdigit() and -len(data) <= int(step) < len(data):
+            data = data[int(step)]
+        else:
+            return None
+    return data
+
+
+def extract_fields(data: Any, fields: Sequence[str]) -> tuple:
+    """Values of dotted field paths (e.g. 'node.shortcode') in a parsed document; None where missing."""
+    return tuple(_project(data, path) for path in _split(fields))
+
+
+def read_metadata(file_path: str, fields: Sequence[str] = (SHORTCODE, COMMENT_COUNT)) -> tuple:
+    """
+    Decompresses an instaloader .json.xz metadata file and returns only the values of `fields`.
+
+    The decompressed bytes go straight to the JSON parser (orjson when installed) without being
+    decoded to a str first, and the parsed document is dropped as soon as the fields are read.
+    With no fields the file is only validated.
+    """
+    return _read_projected(file_path, _split(fields))
+
+
+def _read_projected(file_path: str, paths: List[Tuple[str, ...]]) -> tuple:
+    with lzma.open(file_path, "rb") as f:
+        data = _loads(f.read())
+    return tuple(_project(data, path) for path in paths)
+
+
+def _read_chunk(file_paths: List[str], fields: Sequence[str]) -> List[Tuple[str, Optional[tuple], Optional[str]]]:
+    paths = _split(fields)
+    results = []
+    for file_path in file_paths:
+        try:
+            results.append((file_path, _read_projected(file_path, paths), None))
+        except READ_ERRORS as e:
+            results.append((file_path, None, str(e)))
+    return results
+
+
+def read_metadata_files(
+    file_paths: List[str],
+    fields: Sequence[str] = (SHORTCODE, COMMENT_COUNT),
+    workers: int = METADATA_READ_WORKERS,
+    chunk_size: int = METADATA_READ_CHUNK_SIZE,
+) -> Iterator[Tuple[str, Any, Optional[str]]]:
+    """
+    Decompresses and parses .json.xz metadata files on a process pool.
+
+    Files are sent to the workers in chunks of `chunk_size` and only the values of `fields` are
+    sent back, so neither the compressed nor the parsed documents cross process boundaries. Errors
+    are logged per file.
+
+    Args:
+        file_paths: Paths of the .xz files to read.
+        fields: Dotted field paths to return, see extract_fields. Empty to only validate the files.
+        workers: Worker processes; with 1 worker, or a single chunk, files are read in this process.
+        chunk_size: Files per task.
+
+    Yields:
+        (file_path, tuple of field values, error message) in completion order. The error message is
+        None on success, and the field values are None on failure.
+    """
+    chunk_size = max(1, chunk_size)
+    chunks = [file_paths[i:i + chunk_size] for i in range(0, len(file_paths), chunk_size)]
+
+    if workers <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            yield from _log_errors(_read_chunk(chunk, fields))
+        return
+
+    pool = ProcessPoolExecutor(max_workers=min(workers, len(chunks)))
+    try:
+        futures = [pool.submit(_read_chunk, chunk, fields) for chunk in chunks]
+        for future in as_completed(futures):
+            yield from _log_errors(future.result())
+    finally:
+        # Don't start the remaining chunks if the caller stops early
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def _log_errors(results: List[Tuple[str, Any, Optional[str]]]) -> Iterator[Tuple[str, Any, Optional[str]]]:
+    for file_path, fields, error in results:
+        if error is not None:
+            logging.error(f"Error processing {file_path}: {error}")
+        yield file_path, fields, error
@@ -1,8 +1,146 @@
+import os
 import time
 import logging
+import threading
+from typing import Callable, Optional
 import instaloader
 
-class MyRateController(instaloader.RateController):
+# Request rates are in requests per second
+DOWNLOAD_RATE_INITIAL = float(os.environ.get("DOWNLOAD_RATE_INITIAL", "0.2"))
+
+DOWNLOAD_RATE_MIN = float(os.environ.get("DOWNLOAD_RATE_MIN", "0.01"))
+
+DOWNLOAD_RATE_MAX = float(os.environ.get("DOWNLOAD_RATE_MAX", "0.5"))
+
+# Added to the rate after every successful request
+DOWNLOAD_RATE_INCREASE = float(os.environ.get("DOWNLOAD_RATE_INCREASE", "0.005"))
+
+# Multiplies the rate on a 429 or 302 response
+DOWNLOAD_RATE_DECREASE = float(os.environ.get("DOWNLOAD_RATE_DECREASE", "0.5"))
+
+# Requests that can be made back to back after an idle period
+DOWNLOAD_RATE_BURST = float(os.environ.get("DOWNLOAD_RATE_BURST", "3"))
+
+# Seconds without requests after a backoff; doubles with every consecutive backoff up to the maximum
+DOWNLOAD_BACKOFF_COOLDOWN = float(os.environ.get("DOWNLOAD_BACKOFF_COOLDOWN", "60"))
+
+DOWNLOAD_BACKOFF_MAX_COOLDOWN = float(os.environ.get("DOWNLOAD_BACKOFF_MAX_COOLDOWN", "1800"))
+
+
+class AdaptiveRateController(instaloader.RateController):
+    """
+    Token bucket rate controller whose rate adapts to the server's responses (AIMD): the rate grows
+    by `increase` after every successful request and is multiplied by `decrease` on a backoff
+    (a 429 reported by instaloader through handle_429, or a 429/302 reported through backoff).
+
+    A request counts as successful when the next one starts without a backoff in between. A backoff
+    also imposes a cool-down before the next request: `cooldown` seconds, doubled for every further
+    backoff without a success in between, up to `max_cooldown`.
+    `clock` and `sleeper` can be replaced (e.g. by a fake clock whose sleep advances it) so the
+    controller can be exercised without waiting. Create it before the Instaloader instance and
+    pass `rate_controller=controller.attach`, so the caller keeps a handle to report backoffs and
+    read stats().
+    """
+
+    def __init__(
+        self,
+        context=None,
+        initial_rate: float = DOWNLOAD_RATE_INITIAL,
+        min_rate: float = DOWNLOAD_RATE_MIN,
+        max_rate: float = DOWNLOAD_RATE_MAX,
+        increase: float = DOWNLOAD_RATE_INCREASE,
+        decrease: float = DOWNLOAD_RATE_DECREASE,
+        burst: float = DOWNLOAD_RATE_BURST,
+        cooldown: float = DOWNLOAD_BACKOFF_COOLDOWN,
+        max_cooldown: float = DOWNLOAD_BACKOFF_MAX_COOLDOWN,
+        clock: Callable[[], float] = time.monotonic,
+        sleeper: Callable[[float], None] = time.sleep,
+        name: Optional[str] = None,
+    ):
+        super().__init__(context)
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease = decrease
+        self.burst = max(1.0, burst)
+        self.cooldown = cooldown
+        self.max_cooldown = max(cooldown, max_cooldown)
+        self.name = name or "rate controller"
+        self._clock = clock
+        self._sleeper = sleeper
+        self._lock = threading.Lock()
+
+        self.rate = min(max(initial_rate, min_rate), max_rate)
+        self._tokens = 1.0 # the first request goes out at once, later ones are paced
+        self._last_refill = clock()
+        self._in_flight = False
+        self.requests = 0
+        self.successes = 0
+        self.backoffs = 0
+        self.consecutive_backoffs = 0
+        self.slept = 0.0
+
+    def attach(self, context) -> "AdaptiveRateController":
+        """Instaloader `rate_controller` factory: binds this controller to the loader's context."""
+        self._context = context
+        return self
+
     def sleep(self, secs: float):
-        logging.info(f"Sleeping for {secs:.2f} seconds due to rate limiting...")
-        time.sleep(secs)
\ No newline at end of file
+        with self._lock:
+            self.slept += secs
+        self._sleeper(secs)
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def wait_before_query(self, query_type: str) -> None:
+        with self._lock:
+            # Tokens earned so far accrue at the rate they were earned at
+            self._refill()
+            if self._in_flight:
+                # The previous request finished without a backoff
+                self.successes += 1
+                self.consecutive_backoffs = 0
+                self.rate = min(self.max_rate, self.rate + self.increase)
+            # Take a token now; a negative balance is the wait until it has been earned
+            self._tokens -= 1.0
+            waittime = max(0.0, -self._tokens / self.rate)
+            self.requests += 1
+            self._in_flight = True
+        if waittime > 15:
+            logging.info(f"{self.name}: waiting {waittime:.1f} seconds at {self.rate:.3f} requests/s before the next {query_type} query")
+        if waittime > 0:
+            self.sleep(waittime)
+
+    def backoff(self, reason: str = "429") -> None:
+        """
+        Cuts the rate multiplicatively and starts a cool-down, e.g. after a 429 or a 302 to the
+        login page. The cool-down is a token debt, so the next request waits it out.
+        """
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            cooldown = min(self.max_cooldown, self.cooldown * 2 ** self.consecutive_backoffs)
+            self._tokens = -max(1.0, cooldown * self.rate) + 1.0
+            self._last_refill = self._clock()
+            self._in_flight = False
+            self.backoffs += 1
+            self.consecutive_backoffs += 1
+        logging.warning(f"{self.name}: backing off after {reason}, rate is now {self.rate:.3f} requests/s, cooling down for {cooldown:.0f} seconds")
+
+    def handle_429(self, query_type: str) -> None:
+        # The retried query waits out the cool-down in wait_before_query
+        self.backoff(f"429 on {query_type} query")
+
+    def stats(self) -> dict:
+        """Live statistics: current rate, request/success/backoff counts and seconds spent sleeping."""
+        with self._lock:
+            return {
+                "rate": self.rate,
+                "requests": self.requests,
+                "successes": self.successes,
+                "backoffs": self.backoffs,
+                "consecutive_backoffs": self.consecutive_backoffs,
+                "slept": self.slept,
+            }
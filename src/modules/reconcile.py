@@ -0,0 +1,77 @@
+from typing import Callable, List, Optional
+import polars as pl
+from modules.data_reader import get_column_data
+from modules.metadata_index import MetadataIndex
+from modules.metadata_reader import COMMENT_COUNT, SHORTCODE, read_metadata_files
+from modules.scanner import scan_tree
+
+# Shortcode of a post, reel or IGTV permalink; tolerates a missing scheme or www, a username
+# prefix, query strings, fragments and a missing trailing slash
+SHORTCODE_PATTERN = r"(?i)instagram\.com/(?:[A-Za-z0-9_.]+/)?(?:p|reels?|tv)/([A-Za-z0-9_-]+)"
+
+_DOWNLOADED_SCHEMA = {"directory": pl.String, "shortcode": pl.String, "comment_count": pl.Int64}
+
+
+def shortcode_expr(column: str = "Permalink") -> pl.Expr:
+    """Expression extracting the shortcode of every permalink in `column` (null if it is not a post URL)."""
+    return pl.col(column).cast(pl.String).str.extract(SHORTCODE_PATTERN, 1).alias("shortcode")
+
+
+def excel_permalinks(file_paths: List[str]) -> pl.DataFrame:
+    """Every non-null permalink of the Excel files with its shortcode, as ('Permalink', 'shortcode')."""
+    permalinks = get_column_data(file_paths, as_series=True).alias("Permalink").drop_nulls()
+    return permalinks.to_frame().with_columns(shortcode_expr())
+
+
+def downloaded_posts(download_dir: str, index: Optional[MetadataIndex] = None, directory_filter: Optional[Callable[[str], bool]] = None) -> pl.DataFrame:
+    """
+    Every downloaded metadata file that has a shortcode, as ('directory', 'shortcode', 'comment_count').
+
+    Args:
+        download_dir: Directory containing downloaded posts.
+        index: Persistent metadata index to read the posts from instead of decompressing every .xz file.
+        directory_filter: Only directories for which it returns True are read (without an index,
+                          the others are skipped before any file is decompressed).
+    """
+    if index is not None:
+        index.update(download_dir)
+        posts = index.posts(download_dir)
+        if directory_filter is not None:
+            posts = (post for post in posts if directory_filter(post[0]))
+        return pl.DataFrame(list(posts), schema=_DOWNLOADED_SCHEMA, orient="row")
+
+    directories = {}
+    for root, entries in scan_tree(download_dir, extensions=(".xz",)):
+        if directory_filter is not None and not directory_filter(root):
+            continue
+        for entry in entries:
+            directories[entry.path] = root
+
+    columns = {"directory": [], "shortcode": [], "comment_count": []}
+    for file_path, fields, error in read_metadata_files(list(directories), fields=(SHORTCODE, COMMENT_COUNT)):
+        if error is None and fields[0]:
+            columns["directory"].append(directories[file_path])
+            columns["shortcode"].append(fields[0])
+            columns["comment_count"].append(fields[1])
+    return pl.DataFrame(columns, schema=_DOWNLOADED_SCHEMA)
+
+
+def failed_permalinks(excel: pl.DataFrame, downloaded: pl.DataFrame) -> pl.DataFrame:
+    """Excel rows whose shortcode was never downloaded (or whose permalink is not a post URL)."""
+    return excel.join(downloaded.select("shortcode").unique(), on="shortcode", how="anti", maintain_order="left")
+
+
+def comment_counts(excel: pl.DataFrame, downloaded: pl.DataFrame) -> pl.DataFrame:
+    """
+    Excel rows with the total comment count of their post added as 'Comment Count', in their
+    original order. Posts downloaded more than once are summed; rows without a download get -1.
+    """
+    totals = (
+        downloaded.drop_nulls("comment_count")
+        .group_by("shortcode")
+        .agg(pl.col("comment_count").sum().alias("Comment Count"))
+    )
+    return (
+        excel.join(totals, on="shortcode", how="left", maintain_order="left")
+        .with_columns(pl.col("Comment Count").fill_null(-1))
+    )
@@ -0,0 +1,183 @@
+import os
+import json
+import shutil
+import logging
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Set
+from modules.scanner import scan_tree
+
+REFORMAT_WORKERS = int(os.environ.get("REFORMAT_WORKERS", "8"))
+
+JOURNAL_NAME = ".reformat_journal.jsonl"
+
+REQUIRED_EXTS = {".jpg", ".txt"}
+
+
+def group_prefix(file_name: str) -> str:
+    """Timestamp prefix (first four '_' separated parts) that groups the files of one post."""
+    if 'json' in file_name:
+        return "_".join(os.path.splitext(os.path.splitext(file_name)[0])[0].split("_")[:4])
+    return "_".join(os.path.splitext(file_name)[0].split("_")[:4])
+
+
+def plan_reformat(download_dir: str, destination_dir: str) -> List[dict]:
+    """
+    Builds the migration plan: every group of files sharing a timestamp prefix that has at least
+    a .jpg and a .txt file, with its destination folder '<prefix>_<n>'.
+
+    Directories are visited bottom-up and files in name order, so the same tree always yields the
+    same plan (and folder numbers).
+
+    Returns:
+        One {'id', 'source', 'files', 'destination'} dictionary per group, in plan order.
+    """
+    destination_root = os.path.expanduser(destination_dir)
+    plan = []
+    for root, entries in scan_tree(download_dir, topdown=False):
+        grouped = defaultdict(list)
+        # Group files by timestamp prefix
+        for file in sorted(entry.name for entry in entries):
+            grouped[group_prefix(file)].append(file)
+
+        for prefix, matched_files in grouped.items():
+            found_exts = {os.path.splitext(f)[1] for f in matched_files}
+            if found_exts >= REQUIRED_EXTS:
+                plan.append({
+                    "id": len(plan),
+                    "source": root,
+                    "files": matched_files,
+                    "destination": os.path.join(destination_root, f"{prefix}_{len(plan)}"),
+                })
+    return plan
+
+
+def load_journal(journal_path: str):
+    """Returns (plan, completed group IDs) from a journal, or (None, empty set) if there is none."""
+    if not os.path.exists(journal_path):
+        return None, set()
+    plan, done = None, set()
+    with open(journal_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue # torn last line of an interrupted run
+            if "plan" in record:
+                plan = record["plan"]
+            elif "done" in record:
+                done.add(record["done"])
+    return plan, done
+
+
+def uncovered_groups(plan: List[dict], download_dir: str, destination_dir: str) -> List[dict]:
+    """Groups of a fresh plan of download_dir with files that are not part of `plan` (e.g. downloaded since it was made)."""
+    planned = {(group["source"], f) for group in plan for f in group["files"]}
+    return [group for group in plan_reformat(download_dir, destination_dir)
+            if not all((group["source"], f) in planned for f in group["files"])]
+
+
+class _Journal:
+    """Append-only record of the plan and of every completed group, flushed to disk per line."""
+
+    def __init__(self, journal_path: str):
+        self._lock = threading.Lock()
+        self._file = open(journal_path, "a", encoding="utf-8")
+
+    def write(self, record: dict) -> None:
+        with self._lock:
+            self._file.write(json.dumps(record) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def _move_group(group: dict) -> int:
+    """Moves one group's files into its destination; returns the number of files moved."""
+    os.makedirs(group["destination"], exist_ok=True)
+    same_device = None
+    moved = 0
+    for f in group["files"]:
+        src = os.path.join(group["source"], f)
+        dst = os.path.join(group["destination"], f)
+        tmp = f"{dst}.part"
+
+        if os.path.exists(tmp):
+            # Left behind by a copy that was interrupted; src is still complete
+            os.remove(tmp)
+        if os.path.exists(dst):
+            # Also the case for files moved before an interruption. A cross-device move can be
+            # interrupted after dst was written but before src was removed: finish it
+            if os.path.exists(src):
+                if os.path.getsize(src) == os.path.getsize(dst):
+                    os.remove(src)
+                    logging.debug(f"File {dst} already exists, removed the leftover source {src}.")
+                else:
+                    logging.warning(f"File {dst} already exists and differs in size from {src}, leaving both.")
+            else:
+                logging.debug(f"File {dst} already exists, skipping.")
+            continue
+        if not os.path.exists(src):
+            logging.error(f"File {src} of group {group['id']} no longer exists, skipping.")
+            continue
+        if same_device is None:
+            same_device = os.stat(src).st_dev == os.stat(group["destination"]).st_dev
+        if same_device:
+            os.rename(src, dst) # a metadata-only rename, no copy
+        else:
+            # Copy under a temporary name so an interrupted copy never leaves a partial dst behind
+            shutil.copy2(src, tmp)
+            os.replace(tmp, dst)
+            os.remove(src)
+        moved += 1
+    return moved
+
+
+def execute_reformat(plan: List[dict], journal_path: str, done: Optional[Set[int]] = None, workers: int = REFORMAT_WORKERS) -> int:
+    """
+    Executes the groups of a plan that are not in `done` on a thread pool, recording each
+    completed group in the journal. Returns the number of groups completed by this run.
+    """
+    done = done or set()
+    pending = [group for group in plan if group["id"] not in done]
+    new_journal = not os.path.exists(journal_path)
+    journal = _Journal(journal_path)
+    try:
+        if new_journal:
+            # Record the plan first, so a resumed run reuses the same groups and folder numbers
+            journal.write({"plan": plan})
+
+        def run(group):
+            try:
+                moved = _move_group(group)
+            except OSError as e:
+                logging.error(f"Error moving group {group['id']} to {group['destination']}: {e}")
+                return False
+            journal.write({"done": group["id"]})
+            logging.info(f"Moved {moved} files of group {group['id']} to {group['destination']}")
+            return True
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            completed = sum(pool.map(run, pending))
+    finally:
+        journal.close()
+
+    logging.info(f"Completed {completed} of {len(pending)} pending groups ({len(plan)} planned)")
+    if completed == len(pending):
+        # The plan is done; the next run plans again instead of resuming it
+        os.remove(journal_path)
+        logging.info(f"Migration complete, removed {journal_path}")
+    return completed
+
+
+def write_plan_report(plan: List[dict], report_path: str = "reformat_plan.txt") -> None:
+    """Dry-run report: one line per group with its source, files and destination."""
+    with open(report_path, "w", encoding="utf-8") as f:
+        for group in plan:
+            f.write(f"{group['id']}: {group['source']} {group['files']} -> {group['destination']}\n")
+    total_with_all_three = sum(1 for group in plan if len(group["files"]) == 3)
+    logging.info(f"Planned {len(plan)} groups ({sum(len(group['files']) for group in plan)} files); "
+                 f"{total_with_all_three} groups have all three required files. Report written to {report_path}")
@@ -0,0 +1,69 @@
+import os
+import logging
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+
+def scan_tree(
+    root: str,
+    extensions: Optional[Iterable[str]] = None,
+    prune: Optional[Callable[[os.DirEntry], bool]] = None,
+    topdown: bool = True,
+) -> Iterator[Tuple[str, List[os.DirEntry]]]:
+    """
+    Walks a directory tree with os.scandir, like os.walk but reading every directory only once.
+
+    Each directory is listed with a single scandir call; whether an entry is a file or a directory
+    comes from that listing, and the DirEntry objects cache their stat() result, so callers need no
+    extra stat or listdir calls.
+
+    Args:
+        root: Directory to walk ('~' is expanded).
+        extensions: Only files whose lower-cased name ends with one of these (e.g. ".xz") are
+                    returned. None returns every file.
+        prune: Called with the DirEntry of every subdirectory; returning True skips it and
+               everything below it.
+        topdown: Yield a directory before (True) or after (False) its subdirectories.
+
+    Yields:
+        (directory path, file entries) for every directory that is not pruned, including those
+        without (matching) files. Symlinked directories are not followed.
+    """
+    suffixes = tuple(ext.lower() for ext in extensions) if extensions is not None else None
+    yield from _scan(os.path.expanduser(root), suffixes, prune, topdown)
+
+
+def _scan(path: str, suffixes: Optional[Tuple[str, ...]], prune, topdown: bool) -> Iterator[Tuple[str, List[os.DirEntry]]]:
+    files, subdirs = [], []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    if prune is None or not prune(entry):
+                        subdirs.append(entry.path)
+                elif suffixes is None or entry.name.lower().endswith(suffixes):
+                    if not entry.is_symlink() or not entry.is_dir():
+                        files.append(entry)
+    except OSError as e:
+        logging.warning(f"Cannot scan directory {path}: {e}")
+        return
+
+    if topdown:
+        yield path, files
+    for subdir in subdirs:
+        yield from _scan(subdir, suffixes, prune, topdown)
+    if not topdown:
+        yield path, files
+
+
+def iter_files(
+    root: str,
+    extensions: Optional[Iterable[str]] = None,
+    prune: Optional[Callable[[os.DirEntry], bool]] = None,
+) -> Iterator[os.DirEntry]:
+    """Yields the DirEntry of every (matching) file below `root`; see scan_tree."""
+    for _, files in scan_tree(root, extensions, prune):
+        yield from files